@@ -0,0 +1,83 @@
+"""
+输入文件（预测、未交订单、出货明细、模板）的存储后端：
+- "github"（默认）：GitHub 仓库，写入走 contents API 后台队列，读取走 raw 地址，见 github_utils.GitHubArtifactStore
+- "local"：本地目录（也可以是挂载的对象存储，如 s3fs / gcsfuse），按块流式读写，
+  存取大文件的开销与复制文件相当，没有 base64 膨胀和大小上限
+
+存储后端需提供：
+    put(name, file_obj)   保存文件（文件对象 / 路径 / bytes）
+    get(name) -> bytes    读取全部内容，不存在时抛出 FileNotFoundError
+"""
+import os
+import shutil
+import uuid
+
+ARTIFACT_BACKEND = os.environ.get("FORECAST_ARTIFACT_BACKEND", "github")
+ARTIFACT_STORE_DIR = os.environ.get(
+    "FORECAST_ARTIFACT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "artifacts")
+)
+# 流式读写的块大小
+ARTIFACT_CHUNK_SIZE = 1024 * 1024
+
+
+class LocalArtifactStore:
+    def __init__(self, root: str = ARTIFACT_STORE_DIR, chunk_size: int = ARTIFACT_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, os.path.basename(name))
+
+    def exists(self, name: str) -> bool:
+        return os.path.isfile(self.path(name))
+
+    def put(self, name: str, file_obj) -> str:
+        """按块写入临时文件后原子替换，读取中的旧文件不受影响；返回保存路径"""
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if isinstance(file_obj, (bytes, bytearray)):
+                with open(tmp_path, "wb") as f:
+                    f.write(file_obj)
+            elif isinstance(file_obj, (str, os.PathLike)):
+                shutil.copyfile(file_obj, tmp_path)
+            else:
+                file_obj.seek(0)
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(file_obj, f, self.chunk_size)
+                file_obj.seek(0)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def open(self, name: str):
+        """以二进制流打开，供按块读取"""
+        try:
+            return open(self.path(name), "rb")
+        except FileNotFoundError:
+            raise FileNotFoundError(f"❌ 存储中找不到文件：{name}") from None
+
+    def get(self, name: str) -> bytes:
+        with self.open(name) as f:
+            return f.read()
+
+
+_default_store = None
+
+
+def get_artifact_store():
+    """按 FORECAST_ARTIFACT_BACKEND 返回进程内共享的存储后端"""
+    global _default_store
+    if _default_store is None:
+        if ARTIFACT_BACKEND == "local":
+            _default_store = LocalArtifactStore()
+        elif ARTIFACT_BACKEND == "github":
+            from github_utils import GitHubArtifactStore
+            _default_store = GitHubArtifactStore()
+        else:
+            raise ValueError(f"❌ 不支持的存储后端: {ARTIFACT_BACKEND}，可选: github / local")
+    return _default_store
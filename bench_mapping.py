@@ -0,0 +1,69 @@
+"""
+替代料号替换的微基准：检查 apply_extended_substitute_mapping 的耗时随 行数 + 映射条数 线性增长。
+
+    python bench_mapping.py
+    python bench_mapping.py --tolerance 2.5 --repeat 5
+
+对每组（行数, 映射条数）取多次运行的最短耗时，换算为每万单位耗时；
+最大与最小的每万单位耗时之比超过 tolerance 时判定为非线性，退出码为 1。
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from mapping_utils import apply_extended_substitute_mapping
+
+BENCH_SIZES = ((10_000, 500), (100_000, 2_000), (300_000, 4_000), (1_000_000, 8_000))
+
+
+def make_inputs(n_rows: int, n_records: int, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """一半品名命中替代料号、一半不命中的随机数据"""
+    rng = np.random.default_rng(seed)
+    mapping_df = pd.DataFrame({
+        "替代品名": [f"SUB{i}" for i in range(n_records)],
+        "新品名": [f"NEW{i}" for i in range(n_records)],
+    })
+    pool = np.array([f"SUB{i}" for i in range(n_records)] + [f"P{i}" for i in range(n_records)])
+    df = pd.DataFrame({"品名": pool[rng.integers(0, len(pool), n_rows)], "数量": 1})
+    return df, mapping_df
+
+
+def time_substitute_mapping(n_rows: int, n_records: int, repeat: int = 3) -> float:
+    """多次运行取最短耗时（秒），减少偶发抖动的影响"""
+    df, mapping_df = make_inputs(n_rows, n_records)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        apply_extended_substitute_mapping(df, mapping_df, {"品名": "品名"})
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def check_linear_scaling(sizes=BENCH_SIZES, repeat: int = 3, tolerance: float = 3.0) -> bool:
+    """打印每组耗时及每万单位耗时，返回每万单位耗时的最大/最小比值是否在 tolerance 以内"""
+    per_units = []
+    for n_rows, n_records in sizes:
+        elapsed = time_substitute_mapping(n_rows, n_records, repeat)
+        per_unit = elapsed / (n_rows + n_records) * 10_000
+        per_units.append(per_unit)
+        print(f"rows={n_rows:>9,} records={n_records:>6,}  {elapsed:8.3f}s  {per_unit * 1000:6.2f}ms/万")
+
+    ratio = max(per_units) / min(per_units)
+    linear = ratio <= tolerance
+    print(f"{'✅' if linear else '❌'} 每万单位耗时最大/最小比 {ratio:.2f}（允许 {tolerance}）")
+    return linear
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="替代料号替换的线性扩展检查")
+    parser.add_argument("--repeat", type=int, default=3, help="每组重复次数（取最短耗时）")
+    parser.add_argument("--tolerance", type=float, default=3.0, help="每万单位耗时最大/最小比的上限")
+    args = parser.parse_args(argv)
+    return 0 if check_linear_scaling(repeat=args.repeat, tolerance=args.tolerance) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,52 +1,46 @@
 import pandas as pd
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Alignment, Font
-from openpyxl.utils import get_column_letter
 import pyarrow as pa
-import re
 
-def write_all_forecast_sheets(wb, df_main: pd.DataFrame):
+def write_all_forecast_sheets(wb, df_main: pd.DataFrame, facts: pd.DataFrame = None):
     """
     一键生成所有预测分析相关 Sheet：预测展示、预测展开、预测展开（横向）、订单与预测转置。
+    facts: build_forecast_facts(df_main) 的结果（如 PivotProcessor.forecast_facts），未提供时现场构建。
     """
-    def build_forecast_long_table(df: pd.DataFrame) -> pd.DataFrame:
-        records = []
-        forecast_cols = [col for col in df.columns if "预测" in col and "生成" in col]
-        for _, row in df.iterrows():
-            for col in forecast_cols:
-                match = re.match(r"(\d{4}-\d{2})的预测（(\d{4}-\d{2})生成）", col)
-                if not match:
-                    continue
-                forecast_month, gen_month = match.groups()
-                try:
-                    forecast_val = pd.to_numeric(row[col], errors='coerce')
-                except Exception:
-                    forecast_val = None
-                records.append({
-                    "品名": row.get("品名", ""),
-                    "预测月份": forecast_month,
-                    "生成月份": gen_month,
-                    "预测值": forecast_val,
-                    "订单量": pd.to_numeric(row.get(f"{forecast_month}-订单", 0), errors='coerce'),
-                    "出货量": pd.to_numeric(row.get(f"{forecast_month}-出货", 0), errors='coerce'),
-                })
-        return pd.DataFrame(records)
+    from fact_table import build_forecast_facts
+    from excel_export import plan_sheet_layout, apply_sheet_layout, write_long_table, EXCEL_CHUNK_ROWS
 
-    def write_forecast_expanded_sheet(wb, df_out: pd.DataFrame, sheet_name="预测展开"):
-        ws = wb.create_sheet(title=sheet_name)
-        for r in dataframe_to_rows(df_out, index=False, header=True):
-            ws.append(r)
-        for cell in ws[1]:
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.font = Font(bold=True)
-        for i, col_cells in enumerate(ws.columns, 1):
-            max_len = max(len(str(cell.value)) if cell.value else 0 for cell in col_cells)
-            ws.column_dimensions[get_column_letter(i)].width = max_len + 4
+    if facts is None:
+        facts = build_forecast_facts(df_main)
+
+    def build_forecast_long_table(facts: pd.DataFrame) -> pd.DataFrame:
+        return pd.DataFrame({
+            "品名": facts["品名"].astype(object),
+            "预测月份": facts["预测月份"].astype(str),
+            "生成月份": facts["生成月份"].astype(str),
+            "预测值": facts["预测值"].astype("float64"),
+            "订单量": facts["订单量"].astype("float64").fillna(0),
+            "出货量": facts["出货量"].astype("float64").fillna(0),
+        })
+
+    def iter_forecast_long_table(facts: pd.DataFrame, chunk_rows: int = EXCEL_CHUNK_ROWS):
+        """按块把事实表转换为长表，每次只物化 chunk_rows 行"""
+        for start in range(0, len(facts), chunk_rows):
+            yield build_forecast_long_table(facts.iloc[start:start + chunk_rows])
+
+    def style_header(sheets):
+        for ws in sheets:
+            for cell in ws[1]:
+                cell.alignment = Alignment(horizontal="center", vertical="center")
+                cell.font = Font(bold=True)
+
+    def write_forecast_expanded_sheet(wb, facts: pd.DataFrame, sheet_name="预测展开"):
+        # 长表逐块写入，超过 Excel 行数上限时续写到“预测展开_2”……
+        style_header(write_long_table(wb, iter_forecast_long_table(facts), sheet_name, padding=4))
 
-    def write_forecast_expanded_wide_sheet(wb, df_out: pd.DataFrame, sheet_name="预测展开（横向）"):
-        df = df_out.copy()
-        df["预测月份"] = df["预测月份"].astype(str)
-        df["生成月份"] = df["生成月份"].astype(str)
+    def write_forecast_expanded_wide_sheet(wb, facts: pd.DataFrame, sheet_name="预测展开（横向）"):
+        df = build_forecast_long_table(facts)
         group_fields = ["预测值", "订单量", "出货量"]
         wide = df.pivot_table(
             index=["品名", "预测月份"],
@@ -59,59 +53,26 @@ def write_all_forecast_sheets(wb, df_main: pd.DataFrame):
         ws = wb.create_sheet(title=sheet_name)
         for r in dataframe_to_rows(wide, index=False, header=True):
             ws.append(r)
-        for cell in ws[1]:
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.font = Font(bold=True)
-        for i, col_cells in enumerate(ws.columns, 1):
-            max_len = max(len(str(cell.value)) if cell.value else 0 for cell in col_cells)
-            ws.column_dimensions[get_column_letter(i)].width = max_len + 4
+        style_header([ws])
+        apply_sheet_layout(ws, plan_sheet_layout(wide, padding=4))
 
-    def write_order_forecast_by_month_block(wb, df: pd.DataFrame, sheet_name="订单预测分块"):
+    def write_order_forecast_by_month_block(wb, facts: pd.DataFrame, sheet_name="订单预测分块"):
         """
         将“预测分析”表中每个月份块（如 2025-07生成）提取出来，转换为：
         品名 | 月份 | 预测值 | 订单量
         """
-        forecast_cols = [col for col in df.columns if re.match(r"\d{4}-\d{2}的预测（\d{4}-\d{2}生成）", str(col))]
-        order_cols = [col for col in df.columns if re.match(r"\d{4}-\d{2}-订单", str(col))]
-
-        records = []
-        for _, row in df.iterrows():
-            for fcol in forecast_cols:
-                match = re.match(r"(\d{4}-\d{2})的预测（(\d{4}-\d{2})生成）", fcol)
-                if not match:
-                    continue
-                month, gen = match.groups()
-                record = {
-                    "品名": row["品名"],
-                    "月份": month,
-                    "生成月份": gen,
-                    "预测值": row.get(fcol, 0),
-                    "订单量": row.get(f"{month}-订单", 0),
-                }
-                records.append(record)
-
-        df_final = pd.DataFrame(records)
-        ws = wb.create_sheet(title=sheet_name)
-        for r in dataframe_to_rows(df_final, index=False, header=True):
-            ws.append(r)
-        for cell in ws[1]:
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.font = Font(bold=True)
-        for i, col_cells in enumerate(ws.columns, 1):
-            max_len = max(len(str(cell.value)) if cell.value else 0 for cell in col_cells)
-            ws.column_dimensions[get_column_letter(i)].width = max_len + 4
-
-    # ✅ 构建长表
-    df_out = build_forecast_long_table(df_main)
+        chunks = (
+            chunk.rename(columns={"预测月份": "月份"})[["品名", "月份", "生成月份", "预测值", "订单量"]]
+            for chunk in iter_forecast_long_table(facts)
+        )
+        style_header(write_long_table(wb, chunks, sheet_name, padding=4))
 
     # ✅ 写入多个 Sheet
-    from forecast_utils import merge_monthly_group_headers, merge_and_color_monthly_group_headers
     ws = wb.create_sheet(title="预测展示")
     for r in dataframe_to_rows(df_main, index=False, header=True):
         ws.append(r)
-    merge_monthly_group_headers(ws, df_main)
-    merge_and_color_monthly_group_headers(ws, df_main)
+    apply_sheet_layout(ws, plan_sheet_layout(df_main, month_header=True, padding=None))
 
-    write_forecast_expanded_sheet(wb, df_out)
-    write_forecast_expanded_wide_sheet(wb, df_out)
-    write_order_forecast_by_month_block(wb, df_main)
+    write_forecast_expanded_sheet(wb, facts)
+    write_forecast_expanded_wide_sheet(wb, facts)
+    write_order_forecast_by_month_block(wb, facts)
@@ -0,0 +1,200 @@
+"""
+命令行批处理：不启动 Streamlit，直接运行 PivotProcessor.process 并把结果写到磁盘。
+st.warning / st.error 等提示经 notify 写入日志。
+
+单个任务：
+    python cli.py --forecast "data/bu1/预测_*.xlsx" --order 未交订单.xlsx --sales 出货明细.xlsx \\
+        --mapping 新旧料号.xlsx --output out/bu1 --formats excel parquet
+
+多个任务（并发）：
+    python cli.py --jobs jobs.json --workers 4
+jobs.json 为任务列表，每个任务包含 name、forecast（目录 / 通配符 / 文件列表）、order、sales、mapping、output，
+可选 snapshot_dir、formats、highlight。
+"""
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+
+from columnar_export import COLUMNAR_FORMATS
+
+# 与界面一致的 sheet 读取参数
+INPUT_READ_KWARGS = {
+    "order": {"sheet_name": "Sheet"},
+    "sales": {"sheet_name": "原表"},
+    "mapping": {"sheet_name": 0},
+}
+OUTPUT_FORMATS = ["excel", *COLUMNAR_FORMATS]
+
+logger = logging.getLogger("forecast")
+
+
+class NamedBytesIO(BytesIO):
+    """带文件名的内存文件，与 Streamlit 的 UploadedFile 接口一致（name + seek/read）"""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+
+
+def expand_forecast_paths(patterns, exclude=()) -> list[str]:
+    """
+    目录取其中的 .xlsx，通配符展开，文件原样保留；去重并保持顺序。
+    exclude 中的路径（与预测放在同一目录的订单、出货、新旧料号文件）跳过。
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "*.xlsx"))))
+        elif glob.has_magic(pattern):
+            paths.extend(sorted(glob.glob(pattern)))
+        else:
+            paths.append(pattern)
+    paths = [
+        path for path in dict.fromkeys(paths)
+        if not os.path.basename(path).startswith("~$") and os.path.abspath(path) not in exclude
+    ]
+    if not paths:
+        raise FileNotFoundError(f"❌ 未找到预测文件：{patterns}")
+    return paths
+
+
+def run_job(job: dict) -> dict:
+    """运行一个主计划任务并写出结果，返回摘要 {name, rows, columns, outputs, seconds}"""
+    from parse_cache import read_excel_cached
+    from pivot_processor import PivotProcessor
+    from snapshot_store import ForecastSnapshotStore
+
+    name = job["name"]
+    logging.basicConfig(
+        level=job.get("log_level", "INFO"),
+        format=f"%(asctime)s [{name}] %(levelname)s %(message)s",
+        force=True
+    )
+    started = time.perf_counter()
+
+    forecast_paths = expand_forecast_paths(job["forecast"], exclude=[job[key] for key in INPUT_READ_KWARGS])
+    forecast_files = [NamedBytesIO(path) for path in forecast_paths]
+    inputs = {key: read_excel_cached(job[key], **read_kwargs) for key, read_kwargs in INPUT_READ_KWARGS.items()}
+    logger.info(f"读取 {len(forecast_files)} 个预测文件")
+
+    snapshot_store = ForecastSnapshotStore(job["snapshot_dir"]) if job.get("snapshot_dir") else None
+    processor = PivotProcessor(load_workers=job.get("load_workers", 1), snapshot_store=snapshot_store)
+    main_df, _ = processor.process(forecast_files, inputs["order"], inputs["sales"], inputs["mapping"], excel=False)
+
+    # ✅ 写出结果
+    output_dir = job["output"]
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    formats = job.get("formats") or ["excel"]
+    outputs = []
+    if "excel" in formats:
+        path = os.path.join(output_dir, f"预测分析主计划_{timestamp}.xlsx")
+        with open(path, "wb") as f:
+            f.write(processor.build_excel(main_df, highlight=job.get("highlight", False)).getvalue())
+        outputs.append(path)
+    columnar_formats = [fmt for fmt in formats if fmt in COLUMNAR_FORMATS]
+    if columnar_formats:
+        for file_name, content in processor.build_columnar(main_df, formats=columnar_formats).items():
+            path = os.path.join(output_dir, f"{timestamp}_{file_name}")
+            with open(path, "wb") as f:
+                f.write(content)
+            outputs.append(path)
+
+    seconds = round(time.perf_counter() - started, 2)
+    logger.info(f"✅ 主计划生成成功：{main_df.shape[0]} 行 × {main_df.shape[1]} 列，用时 {seconds}s")
+    return {"name": name, "rows": main_df.shape[0], "columns": main_df.shape[1], "outputs": outputs, "seconds": seconds}
+
+
+def _run_job_safe(job: dict) -> dict:
+    """单个任务失败不影响其他任务：异常记录到日志并写入摘要的 error"""
+    try:
+        return run_job(job)
+    except Exception as e:
+        logger.exception(f"❌ 任务 {job.get('name')} 失败")
+        return {"name": job.get("name"), "error": str(e)}
+
+
+def run_jobs(jobs: list[dict], workers: int = 1) -> list[dict]:
+    """workers > 1 时各任务在独立子进程中并发运行（spawn，与预测解析进程池一致）；结果顺序与任务顺序一致"""
+    if workers <= 1 or len(jobs) <= 1:
+        return [_run_job_safe(job) for job in jobs]
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=ctx) as pool:
+        return list(pool.map(_run_job_safe, jobs))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="预测分析主计划批处理（无需 Streamlit）")
+    parser.add_argument("--jobs", help="任务列表 JSON 文件；提供时忽略单任务参数")
+    parser.add_argument("--forecast", nargs="+", help="预测文件：目录、通配符或文件路径")
+    parser.add_argument("--order", help="未交订单 Excel（Sheet）")
+    parser.add_argument("--sales", help="出货明细 Excel（原表）")
+    parser.add_argument("--mapping", help="新旧料号 Excel")
+    parser.add_argument("--output", help="输出目录")
+    parser.add_argument("--name", default="plan", help="任务名（用于日志）")
+    parser.add_argument("--snapshot-dir", help="预测快照库目录；提供时合并历史预测")
+    parser.add_argument("--formats", nargs="+", choices=OUTPUT_FORMATS, default=["excel"], help="输出格式")
+    parser.add_argument("--highlight", action="store_true", help="Excel 中标红“预测>0 且 订单为空或 0”的单元格")
+    parser.add_argument("--workers", type=int, default=1, help="并发运行的任务数")
+    parser.add_argument("--load-workers", type=int, default=1, help="每个任务解析预测文件的进程数")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+
+    if not args.jobs:
+        missing = [opt for opt in ("forecast", "order", "sales", "mapping", "output") if not getattr(args, opt)]
+        if missing:
+            parser.error(f"缺少参数：{', '.join('--' + opt for opt in missing)}（或使用 --jobs）")
+    return args
+
+
+def load_jobs(args) -> list[dict]:
+    """由 --jobs 文件或单任务参数得到任务列表；命令行的格式、日志级别等作为各任务的默认值"""
+    defaults = {
+        "formats": args.formats,
+        "highlight": args.highlight,
+        "snapshot_dir": args.snapshot_dir,
+        "load_workers": args.load_workers,
+        "log_level": args.log_level,
+    }
+    if args.jobs:
+        with open(args.jobs, encoding="utf-8") as f:
+            jobs = json.load(f)
+        return [{**defaults, "name": f"job{i}", **job} for i, job in enumerate(jobs, 1)]
+    return [{
+        **defaults,
+        "name": args.name,
+        "forecast": args.forecast,
+        "order": args.order,
+        "sales": args.sales,
+        "mapping": args.mapping,
+        "output": args.output,
+    }]
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(message)s")
+    results = run_jobs(load_jobs(args), workers=args.workers)
+
+    failed = [result for result in results if "error" in result]
+    for result in results:
+        if "error" in result:
+            print(f"❌ {result['name']}: {result['error']}")
+        else:
+            print(f"✅ {result['name']}: {result['rows']} 行 × {result['columns']} 列，{result['seconds']}s → {', '.join(result['outputs'])}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
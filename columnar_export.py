@@ -0,0 +1,106 @@
+"""
+列式导出：主计划、月度展开、预测事实表直接由 DataFrame 导出为 Parquet / Arrow IPC / CSV，
+不经过 openpyxl，可单独下载或打包为一个 ZIP。
+"""
+import threading
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# 格式 → 文件扩展名
+COLUMNAR_FORMATS = {
+    "parquet": "parquet",
+    "arrow": "arrow",
+    "csv": "csv",
+}
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Arrow 不接受混合类型的 object 列（如月度展开中缺列时以 "" 占位的订单/出货）：
+    能无损转为数值的转为数值（"" 视为空），否则转为字符串。
+    """
+    fixes = {}
+    for col in df.columns[df.dtypes == object]:
+        values = df[col]
+        if not pd.api.types.infer_dtype(values, skipna=True).startswith("mixed"):
+            continue
+        blank = values.isna() | (values == "")
+        numeric = pd.to_numeric(values.where(~blank, np.nan), errors="coerce")
+        if numeric[~blank].notna().all():
+            fixes[col] = numeric
+        else:
+            fixes[col] = values.astype(str).where(values.notna(), None)
+    return df.assign(**fixes) if fixes else df
+
+
+def export_frame(df: pd.DataFrame, fmt: str) -> bytes:
+    """将单个 DataFrame 导出为指定格式的字节"""
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"❌ 不支持的导出格式: {fmt}，可选: {list(COLUMNAR_FORMATS)}")
+
+    if fmt == "csv":
+        # utf-8-sig：Excel 直接打开中文不乱码
+        return df.to_csv(index=False).encode("utf-8-sig")
+
+    df = _arrow_safe(df)
+    buffer = BytesIO()
+    if fmt == "parquet":
+        df.to_parquet(buffer, index=False)
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.ipc.new_file(buffer, table.schema) as writer:
+            writer.write_table(table)
+    return buffer.getvalue()
+
+
+def export_tables(tables: dict[str, pd.DataFrame], formats=tuple(COLUMNAR_FORMATS)) -> dict[str, bytes]:
+    """将多张表按多种格式导出，返回 {文件名: 字节}，文件名为“表名.扩展名”"""
+    return {
+        f"{name}.{COLUMNAR_FORMATS[fmt]}": export_frame(df, fmt)
+        for name, df in tables.items()
+        for fmt in formats
+    }
+
+
+def zip_files(files: dict[str, bytes]) -> bytes:
+    """将 {文件名: 字节} 打包为 ZIP"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buffer.getvalue()
+
+
+class LazyExports:
+    """
+    按需导出：tables 为 {表名: 返回 DataFrame 的函数}，某张表的某种格式首次被请求时才构建该表并导出，
+    字节按 (表名, 格式) 缓存，之后的请求（含页面重跑）直接复用；可在下载回调线程中调用。
+    """
+    def __init__(self, tables: dict):
+        self.tables = tables
+        self._files = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def file(self, name: str, fmt: str) -> bytes:
+        with self._lock:
+            created = (name, fmt) not in self._files
+            if created:
+                self._files[(name, fmt)] = export_frame(self.tables[name](), fmt)
+            content = self._files[(name, fmt)]
+        if created:
+            for callback in self._callbacks:
+                callback(self)
+        return content
+
+    def add_done_callback(self, callback):
+        """每生成一个新文件后调用 callback(self)（与 Future 同名，供结果缓存更新占用大小）"""
+        self._callbacks.append(callback)
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(len(content) for content in self._files.values())
@@ -0,0 +1,272 @@
+"""
+流式 Excel 导出：openpyxl write-only 模式，按块把行直接写入 xlsx，不在内存中保留单元格对象。
+保留“预测分析”的两行表头（月份合并 + 着色）和按内容计算的列宽，内存占用基本不随行数增长。
+"""
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+from forecast_utils import MONTH_HEADER_FILL_COLORS, month_column_groups
+
+# 每次转换并写入的行数
+EXCEL_CHUNK_ROWS = 10000
+# 计算列宽时最多抽样的行数；None 表示全量计算
+EXCEL_WIDTH_SAMPLE_ROWS = 20000
+
+# Excel 单个 sheet 的行数上限（含表头）
+EXCEL_MAX_ROWS = 1048576
+# Excel sheet 名长度上限
+EXCEL_MAX_SHEET_NAME = 31
+
+# 共享样式对象：所有月份表头单元格引用同一组样式
+MONTH_HEADER_FONT = Font(bold=True)
+MONTH_HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+MONTH_HEADER_FILLS = [
+    PatternFill(start_color=color, end_color=color, fill_type="solid") for color in MONTH_HEADER_FILL_COLORS
+]
+
+# 列名行样式：与 pandas to_excel 写出的表头一致（加粗、细边框、水平居中、顶端对齐）
+COLUMN_HEADER_FONT = Font(bold=True)
+COLUMN_HEADER_BORDER = Border(left=Side(style="thin"), right=Side(style="thin"),
+                              top=Side(style="thin"), bottom=Side(style="thin"))
+COLUMN_HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
+
+
+def column_header_cells(ws, columns) -> list:
+    """按 to_excel 的表头样式生成列名行的 WriteOnlyCell"""
+    cells = []
+    for value in columns:
+        cell = WriteOnlyCell(ws, value=value)
+        cell.font = COLUMN_HEADER_FONT
+        cell.border = COLUMN_HEADER_BORDER
+        cell.alignment = COLUMN_HEADER_ALIGNMENT
+        cells.append(cell)
+    return cells
+
+
+def width_sample(df: pd.DataFrame, sample_rows) -> pd.DataFrame:
+    """行数超过 sample_rows 时抽样（固定种子），并补上各数值列最大、最小值所在行"""
+    if sample_rows is None or len(df) <= sample_rows:
+        return df
+    rng = np.random.default_rng(0)
+    positions = set(rng.choice(len(df), size=sample_rows, replace=False).tolist())
+    numeric = df.select_dtypes("number")
+    if not numeric.empty:
+        values = numeric.to_numpy(dtype=float)
+        if np.isfinite(values).any():
+            filled = np.where(np.isfinite(values), values, 0)
+            positions.update(filled.argmax(axis=0).tolist())
+            positions.update(filled.argmin(axis=0).tolist())
+    return df.iloc[sorted(positions)]
+
+
+def column_widths(df: pd.DataFrame, header_rows: list[list], padding: int = 10,
+                  sample_rows=EXCEL_WIDTH_SAMPLE_ROWS) -> list[int]:
+    """
+    列宽 = 该列（含表头行）非空单元格 str 后的最大长度 + padding，与逐个扫描单元格的结果一致；
+    行数较多时按 sample_rows 抽样估算。
+    """
+    sample = width_sample(df, sample_rows)
+    widths = []
+    for idx in range(df.shape[1]):
+        values = sample.iloc[:, idx]
+        # 与 `if cell.value` 一致：空值、0、空串不计入
+        non_empty = values[values.notna() & (values.astype(object) != 0) & (values.astype(object) != "")]
+        max_len = int(non_empty.astype(str).str.len().max()) if len(non_empty) else 0
+        for header in header_rows:
+            if header[idx]:
+                max_len = max(max_len, len(str(header[idx])))
+        widths.append(max_len + padding)
+    return widths
+
+
+def plan_sheet_layout(df: pd.DataFrame, month_header: bool = False, padding: int = 10,
+                      sample_rows=EXCEL_WIDTH_SAMPLE_ROWS, highlight: bool = False) -> dict:
+    """
+    由 DataFrame 一次算出 sheet 的版式，不扫描单元格：
+    - header_rows: 表头行（month_header=True 时首行为按月份的“yyyy-mm”，第二行为列名）
+    - merges: 需要合并的 CellRange 列表（同月份 ≥2 列）
+    - fills: {列索引: 共享 PatternFill}，月份列的两行表头着色
+    - widths: 各列宽度；padding=None 时不计算（None）
+    - highlight_pairs: highlight=True 时需要条件格式标红的“预测/订单”列对
+    """
+    from info_extract import detect_forecast_order_pairs
+
+    columns = [str(col) for col in df.columns]
+    header_rows = [columns]
+    merges = []
+    fills = {}
+    if month_header:
+        month_row = [None] * len(columns)
+        for i, (month, col_indexes) in enumerate(sorted(month_column_groups(columns).items())):
+            month_row[col_indexes[0] - 1] = month
+            for col in col_indexes:
+                fills[col] = MONTH_HEADER_FILLS[i % len(MONTH_HEADER_FILLS)]
+            if len(col_indexes) >= 2:
+                merges.append(CellRange(min_col=col_indexes[0], min_row=1, max_col=col_indexes[-1], max_row=1))
+        header_rows.insert(0, month_row)
+
+    return {
+        "header_rows": header_rows,
+        "month_header": month_header,
+        "merges": merges,
+        "fills": fills,
+        "widths": None if padding is None else column_widths(df, header_rows, padding, sample_rows),
+        "highlight_pairs": detect_forecast_order_pairs(columns) if highlight else [],
+    }
+
+
+def apply_sheet_layout(ws, layout: dict, start_row: int = 1):
+    """
+    将版式一次性应用到普通（非 write-only）工作表：列宽、月份标签与合并、两行表头着色。
+    列名与数据行由调用方写入。
+    """
+    if layout["widths"] is not None:
+        for col_idx, width in enumerate(layout["widths"], 1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = width
+    if not layout["month_header"]:
+        return
+
+    # 先合并再写值、着色（合并会重建区域内的单元格）
+    for cell_range in layout["merges"]:
+        ws.merge_cells(start_row=start_row, start_column=cell_range.min_col, end_row=start_row, end_column=cell_range.max_col)
+    for col_idx, value in enumerate(layout["header_rows"][0], 1):
+        if value is not None:
+            cell = ws.cell(row=start_row, column=col_idx, value=value)
+            cell.font = MONTH_HEADER_FONT
+            cell.alignment = MONTH_HEADER_ALIGNMENT
+    for col_idx, fill in layout["fills"].items():
+        ws.cell(row=start_row, column=col_idx).fill = fill
+        ws.cell(row=start_row + 1, column=col_idx).fill = fill
+
+
+def iter_dataframe_rows(df: pd.DataFrame, chunk_rows: int = EXCEL_CHUNK_ROWS):
+    """按块把 DataFrame 转为 Python 值的行列表（空值为 None），每次只物化 chunk_rows 行"""
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows].astype(object)
+        yield from chunk.where(chunk.notna(), None).to_numpy().tolist()
+
+
+def write_dataframe_sheet(wb: Workbook, df: pd.DataFrame, sheet_name: str, month_header: bool = False,
+                          highlight: bool = False, padding: int = 10, chunk_rows: int = EXCEL_CHUNK_ROWS):
+    """
+    向 write-only 工作簿追加一个 sheet。
+    month_header=True 时第一行为按月份合并、着色的“yyyy-mm”，第二行为列名（着色同月份）。
+    highlight=True 时为“预测>0 且 订单=0”添加条件格式。
+    列宽、合并区域需在写行之前确定，因此先由 plan_sheet_layout 计算。
+    """
+    ws = wb.create_sheet(title=sheet_name)
+    layout = plan_sheet_layout(df, month_header=month_header, padding=padding, highlight=highlight)
+
+    for col_idx, width in enumerate(layout["widths"], 1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = width
+    for cell_range in layout["merges"]:
+        ws.merged_cells.add(cell_range)
+    if layout["highlight_pairs"]:
+        from info_extract import add_forecast_order_highlight
+        first_row = len(layout["header_rows"]) + 1
+        add_forecast_order_highlight(ws, layout["highlight_pairs"], first_row, first_row + len(df) - 1)
+
+    # ✅ 表头：月份行（可选）+ 列名行（to_excel 样式）
+    fills = layout["fills"]
+    *month_rows, column_row = layout["header_rows"]
+    for header in month_rows:
+        cells = []
+        for col_idx, value in enumerate(header, 1):
+            cell = WriteOnlyCell(ws, value=value)
+            if col_idx in fills:
+                cell.fill = fills[col_idx]
+            if value is not None:
+                cell.alignment = MONTH_HEADER_ALIGNMENT
+                cell.font = MONTH_HEADER_FONT
+            cells.append(cell)
+        ws.append(cells)
+    cells = column_header_cells(ws, column_row)
+    for col_idx, cell in enumerate(cells, 1):
+        if col_idx in fills:
+            cell.fill = fills[col_idx]
+    ws.append(cells)
+
+    # ✅ 数据行：逐块写出
+    for row in iter_dataframe_rows(df, chunk_rows):
+        ws.append(row)
+    return ws
+
+
+def continuation_sheet_name(sheet_name: str, index: int) -> str:
+    """第 1 个 sheet 用原名，之后依次为“名称_2”“名称_3”……（截断到 Excel 的 31 字符上限）"""
+    if index == 1:
+        return sheet_name[:EXCEL_MAX_SHEET_NAME]
+    suffix = f"_{index}"
+    return sheet_name[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix
+
+
+def write_long_table(wb: Workbook, chunks, sheet_name: str, columns: list = None, widths: list = None,
+                     padding: int = 10, max_rows: int = EXCEL_MAX_ROWS, styled_header: bool = False) -> list:
+    """
+    将分块产生的长表（DataFrame 的可迭代对象，如生成器）逐块写入，任何时候只持有当前一块。
+    写满 max_rows 行（含表头）后续写到编号的续表 sheet（名称_2、名称_3……），每个续表都带表头。
+    widths 未提供时按第一块计算；styled_header=True 时列名行使用 to_excel 的表头样式（仅 write-only 工作簿）。
+    write-only 与普通工作簿均可使用。返回写入的工作表列表。
+    """
+    sheets = []
+    ws = None
+    rows_left = 0
+
+    def new_sheet():
+        ws = wb.create_sheet(title=continuation_sheet_name(sheet_name, len(sheets) + 1))
+        for col_idx, width in enumerate(widths or [], 1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = width
+        header = [str(col) for col in columns]
+        ws.append(column_header_cells(ws, header) if styled_header else header)
+        sheets.append(ws)
+        return ws
+
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+        chunk = chunk[columns]
+        if widths is None:
+            widths = column_widths(chunk, [[str(col) for col in columns]], padding)
+
+        start = 0
+        while start < len(chunk) or ws is None:
+            if ws is None or rows_left == 0:
+                ws = new_sheet()
+                rows_left = max_rows - 1
+            part = chunk.iloc[start:start + rows_left]
+            for row in iter_dataframe_rows(part):
+                ws.append(row)
+            rows_left -= len(part)
+            start += len(part)
+
+    # 没有任何数据块时仍写出只有表头的 sheet
+    if ws is None:
+        columns = columns or []
+        new_sheet()
+    return sheets
+
+
+def export_workbook(sheets: list[tuple]) -> BytesIO:
+    """
+    sheets: [(sheet 名, 数据, 选项), ...]，按顺序流式写入，返回 BytesIO。
+    - 数据为 DataFrame：选项为 write_dataframe_sheet 的关键字参数（如 {"month_header": True, "highlight": True}）
+    - 数据为 DataFrame 块的迭代器（长表）：选项为 write_long_table 的关键字参数，超出行数上限时续写到新 sheet
+    """
+    wb = Workbook(write_only=True)
+    for sheet_name, data, options in sheets:
+        if isinstance(data, pd.DataFrame):
+            write_dataframe_sheet(wb, data, sheet_name, **options)
+        else:
+            write_long_table(wb, data, sheet_name, **options)
+
+    output = BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
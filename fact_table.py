@@ -0,0 +1,65 @@
+"""
+预测事实长表：主计划中每个 (品名, 预测月份, 生成月份) 一行，附带该月的订单、出货。
+“月度展开”、chart_utils 中的各展开 sheet 都从这张表派生，不再各自逐行遍历主计划。
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+FORECAST_COLUMN_PATTERN = re.compile(r"(\d{4}-\d{2})的预测（(\d{4}-\d{2})生成）")
+
+FACT_COLUMNS = ["行号", "品名", "预测月份", "生成月份", "预测值", "订单量", "出货量"]
+
+
+def _compact_values(values: np.ndarray) -> np.ndarray:
+    """数值列无损时存为 float32（整数数量 < 2^24 的常见情况），否则保留 float64"""
+    values = np.asarray(values, dtype=np.float64)
+    compact = values.astype(np.float32)
+    if np.array_equal(compact, values, equal_nan=True):
+        return compact
+    return values
+
+
+def build_forecast_facts(main_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    由主计划生成预测事实长表，行按主计划行序、同一行内按预测列顺序排列。
+    - 行号：主计划中的行位置（int32），用于取回晶圆品名/规格等识别列
+    - 品名：Categorical
+    - 预测月份、生成月份：Period[M]
+    - 预测值、订单量、出货量：float32（有损时为 float64）；主计划缺少该月订单/出货列时为空
+    """
+    forecast_cols = []
+    for col in main_df.columns:
+        match = FORECAST_COLUMN_PATTERN.match(str(col))
+        if match:
+            forecast_cols.append((col, match.group(1), match.group(2)))
+
+    n_rows, n_cols = len(main_df), len(forecast_cols)
+    rows = np.repeat(np.arange(n_rows, dtype=np.int32), n_cols)
+    col_idx = np.tile(np.arange(n_cols), n_rows)
+
+    forecast_months = pd.PeriodIndex([m for _, m, _ in forecast_cols], freq="M")
+    gen_months = pd.PeriodIndex([gen for _, _, gen in forecast_cols], freq="M")
+
+    # 每个预测列对应月份的订单/出货（n_rows × n_cols），缺列为空
+    def month_values(kind):
+        block = np.full((n_rows, n_cols), np.nan)
+        for i, (_, m, _) in enumerate(forecast_cols):
+            col = f"{m}-{kind}"
+            if col in main_df.columns:
+                block[:, i] = pd.to_numeric(main_df[col], errors="coerce").to_numpy(dtype=np.float64)
+        return block.reshape(-1)
+
+    forecast_values = main_df[[col for col, _, _ in forecast_cols]].apply(pd.to_numeric, errors="coerce")
+    name_codes, name_uniques = pd.factorize(main_df["品名"]) if "品名" in main_df.columns else (np.full(n_rows, -1), [])
+
+    return pd.DataFrame({
+        "行号": rows,
+        "品名": pd.Categorical.from_codes(name_codes[rows], categories=pd.Index(name_uniques)),
+        "预测月份": forecast_months.take(col_idx),
+        "生成月份": gen_months.take(col_idx),
+        "预测值": _compact_values(forecast_values.to_numpy(dtype=np.float64).reshape(-1)),
+        "订单量": _compact_values(month_values("订单")),
+        "出货量": _compact_values(month_values("出货")),
+    }, columns=FACT_COLUMNS)
@@ -0,0 +1,157 @@
+"""
+预测文件读取（不依赖 streamlit，可在子进程中轻量导入）。
+"""
+import importlib.util
+from io import BytesIO
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from parse_cache import get_parse_cache, file_bytes
+
+
+# 预测文件读取后端（按优先级）：(后端名, 所需模块)
+FORECAST_READER_BACKENDS = [
+    ("calamine", "python_calamine"),
+    ("openpyxl", "openpyxl"),
+]
+FORECAST_HEADER_KEYWORD = "产品型号"
+FORECAST_HEADER_SCAN_ROWS = 50
+
+
+def detect_reader_backend(preferred: str = None) -> str:
+    """
+    返回可用的最快读取后端名；指定 preferred 时仅校验其是否已安装。
+    """
+    available = [name for name, module in FORECAST_READER_BACKENDS if importlib.util.find_spec(module) is not None]
+    if preferred:
+        if preferred not in available:
+            raise ValueError(f"❌ 读取后端 {preferred} 不可用，可用后端：{available}")
+        return preferred
+    return available[0]
+
+
+def _select_longest_sheet(wb) -> str:
+    """
+    从 workbook 元数据（<dimension>）中选出行数最多的 sheet；
+    元数据缺失时退化为流式计数，不解析单元格内容。
+    """
+    selected_sheet, max_rows = None, -1
+    for ws in wb.worksheets:
+        n_rows = ws.max_row
+        if n_rows is None or (n_rows <= 1 and ws.max_column <= 1):
+            n_rows = sum(1 for _ in ws.iter_rows(values_only=True))
+        if n_rows > max_rows:
+            selected_sheet, max_rows = ws.title, n_rows
+    return selected_sheet
+
+
+def _find_header_row(ws, keyword: str, scan_rows: int):
+    """只扫描前 scan_rows 行，返回包含 keyword 的首行下标（从 0 开始）"""
+    for idx, row in enumerate(ws.iter_rows(max_row=scan_rows, values_only=True)):
+        if any(keyword in str(v) for v in row if v is not None):
+            return idx
+    return None
+
+
+def read_forecast_workbook(file, backend: str = None, header_keyword: str = FORECAST_HEADER_KEYWORD,
+                           scan_rows: int = FORECAST_HEADER_SCAN_ROWS) -> tuple[pd.DataFrame, dict]:
+    """
+    单次解析读取预测文件：
+    - 用 openpyxl 只读流式模式按元数据选出最长的 sheet
+    - 只扫描前 scan_rows 行识别 header 行
+    - 用可用的最快后端解析数据区，且只解析一次
+    返回 (DataFrame, 读取信息{sheet, header_row, backend})；未找到 header 行时 DataFrame 为 None。
+    """
+    backend = detect_reader_backend(backend)
+
+    if hasattr(file, "seek"):
+        file.seek(0)
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        sheet = _select_longest_sheet(wb)
+        header_row = _find_header_row(wb[sheet], header_keyword, scan_rows)
+        info = {"sheet": sheet, "header_row": header_row, "backend": backend}
+        if header_row is None:
+            return None, info
+
+        if backend == "openpyxl":
+            # 复用已打开的只读 workbook，避免再次解压
+            df = pd.read_excel(wb, sheet_name=sheet, header=header_row, engine="openpyxl")
+        else:
+            if hasattr(file, "seek"):
+                file.seek(0)
+            df = pd.read_excel(file, sheet_name=sheet, header=header_row, engine=backend)
+    finally:
+        wb.close()
+
+    df.attrs["reader"] = info
+    return df, info
+
+
+def read_forecast_workbook_cached(file, backend: str = None) -> tuple[pd.DataFrame, dict]:
+    """
+    带内容寻址缓存的 read_forecast_workbook：文件字节未变时直接返回上次的解析结果。
+    读取后端是缓存键的一部分，不同后端的解析结果分别缓存；命中时 info["cached"] 为 True。
+    """
+    backend = detect_reader_backend(backend)
+    cache = get_parse_cache()
+    if cache is None:
+        return read_forecast_workbook(file, backend=backend)
+
+    content = file_bytes(file)
+    info = {}
+
+    def parse():
+        df, parsed_info = read_forecast_workbook(BytesIO(content), backend=backend)
+        info.update(parsed_info)
+        return df
+
+    df = cache.get_or_parse(content, parse, **_forecast_cache_params(backend))
+    if df is not None and not info:
+        info = dict(df.attrs.get("reader", {}), cached=True)
+    return df, info
+
+
+def _forecast_cache_params(backend: str) -> dict:
+    """预测解析结果的缓存参数（与内容一起组成缓存键）"""
+    return {"kind": "forecast", "backend": backend, "header_keyword": FORECAST_HEADER_KEYWORD, "scan_rows": FORECAST_HEADER_SCAN_ROWS}
+
+
+def lookup_forecast_cache(content: bytes, backend: str = None):
+    """只查缓存、不解析：命中时返回 DataFrame，未命中或缓存禁用时返回 None"""
+    cache = get_parse_cache()
+    if cache is None:
+        return None
+    backend = detect_reader_backend(backend)
+    return cache.get(cache.make_key(content, **_forecast_cache_params(backend)))
+
+
+def _read_one_forecast(file, file_name: str, backend: str = None) -> tuple[pd.DataFrame, str, str]:
+    """
+    读取单个预测文件并将第二列统一为“品名”。
+    返回 (df, 级别, 提示信息)；成功时级别和提示信息为 None，失败时 df 为 None、级别为 "warning"/"error"。
+    """
+    try:
+        df, info = read_forecast_workbook_cached(file, backend=backend)
+        return _forecast_result(df, file_name)
+    except Exception as e:
+        return None, "error", f"❌ 无法读取文件 {file_name}: {e}"
+
+
+def _forecast_result(df: pd.DataFrame, file_name: str) -> tuple[pd.DataFrame, str, str]:
+    if df is None:
+        return None, "warning", f"⚠ 文件 {file_name} 中未找到包含“产品型号”的表头行，跳过"
+
+    # 统一第二列为“品名”（重建列索引；原地改 columns.values 会使已建立的列名查找表失效）
+    if df.shape[1] >= 2:
+        columns = list(df.columns)
+        columns[1] = "品名"
+        df.columns = columns
+
+    return df, None, None
+
+
+def _read_forecast_bytes(file_name: str, content: bytes, backend: str = None) -> tuple[pd.DataFrame, str, str]:
+    """子进程入口：从文件字节解析单个预测文件"""
+    return _read_one_forecast(BytesIO(content), file_name, backend)
@@ -1,14 +1,16 @@
 import pandas as pd
-import streamlit as st
+from notify import notify
 import re
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from io import BytesIO
 
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.styles import Alignment, Font
+from parse_cache import file_bytes
+from forecast_reader import lookup_forecast_cache, _read_one_forecast, _read_forecast_bytes, _forecast_result
 
-from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
 
 def drop_order_shipping_without_forecast(main_df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -37,67 +39,23 @@ def drop_order_shipping_without_forecast(main_df: pd.DataFrame) -> pd.DataFrame:
     return main_df.drop(columns=drop_cols)
 
 
-def merge_and_color_monthly_group_headers(ws: Worksheet, df: pd.DataFrame, start_row: int = 1):
-    """
-    合并并着色同一个月份的字段（如“预测/订单/出货”）标题行。
-    """
-    pattern = re.compile(r"(\d{4}-\d{2})")
-    col_groups = {}  # {月份: [列索引]}
-    
-    for idx, col in enumerate(df.columns, start=1):  # openpyxl 列从 1 开始
-        match = pattern.search(str(col))
-        if match:
-            month = match.group(1)
-            col_groups.setdefault(month, []).append(idx)
-
-    fill_colors = [
-        "FFF2CC", "D9EAD3", "D0E0E3", "F4CCCC", "EAD1DC", "CFE2F3", "FFE599", "E6B8AF"
-    ]
-
-    for i, (month, col_indexes) in enumerate(sorted(col_groups.items())):
-        start_col = col_indexes[0]
-        end_col = col_indexes[-1]
-        cell = ws.cell(row=start_row, column=start_col)
-        ws.merge_cells(start_row=start_row, start_column=start_col, end_row=start_row, end_column=end_col)
-        cell.value = month
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-        cell.font = Font(bold=True)
-
-        fill = PatternFill(start_color=fill_colors[i % len(fill_colors)],
-                           end_color=fill_colors[i % len(fill_colors)],
-                           fill_type="solid")
-        for col in col_indexes:
-            ws.cell(row=start_row, column=col).fill = fill
-            ws.cell(row=start_row + 1, column=col).fill = fill
+# 月份表头的轮换底色
+MONTH_HEADER_FILL_COLORS = [
+    "FFF2CC", "D9EAD3", "D0E0E3", "F4CCCC", "EAD1DC", "CFE2F3", "FFE599", "E6B8AF"
+]
 
 
-def merge_monthly_group_headers(ws: Worksheet, df: pd.DataFrame, start_row: int = 1):
-    """
-    将同一月份的“预测/订单/出货”等字段在 Excel 中合并单元格并写入“yyyy-mm”。
-    
-    参数：
-        ws: openpyxl 的 worksheet 对象
-        df: DataFrame，用于获取列顺序
-        start_row: 起始行（默认为 1）
-    """
+def month_column_groups(columns) -> dict[str, list[int]]:
+    """按列名中的 yyyy-mm 分组，返回 {月份: [列索引]}（列索引从 1 开始，与 openpyxl 一致）"""
     pattern = re.compile(r"(\d{4}-\d{2})")
-    col_groups = {}  # {月份: [列索引]}
-    
-    for idx, col in enumerate(df.columns, start=1):  # openpyxl 列从 1 开始
+    col_groups = {}
+
+    for idx, col in enumerate(columns, start=1):
         match = pattern.search(str(col))
         if match:
             month = match.group(1)
             col_groups.setdefault(month, []).append(idx)
-
-    for month, col_indexes in col_groups.items():
-        if len(col_indexes) >= 2:
-            start_col = col_indexes[0]
-            end_col = col_indexes[-1]
-            cell = ws.cell(row=start_row, column=start_col)
-            ws.merge_cells(start_row=start_row, start_column=start_col, end_row=start_row, end_column=end_col)
-            cell.value = month
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-            cell.font = Font(bold=True)
+    return col_groups
 
 
 # ✅ 对列进行排序：按月份分组排序，预测/订单/出货顺序
@@ -232,7 +190,7 @@ def merge_forecast_columns(forecast_dfs: dict[str, pd.DataFrame]) -> pd.DataFram
             for subdf in forecast_parts.values():
                 all_parts.append(subdf)
         except Exception as e:
-            st.warning(f"⚠ 处理 {file_name} 失败：{e}")
+            notify("warning", f"⚠ 处理 {file_name} 失败：{e}")
 
     # 统一合并
     if not all_parts:
@@ -276,45 +234,86 @@ def parse_forecast_columns(df: pd.DataFrame, file_name: str) -> dict[str, pd.Ser
 
     return forecast_cols  # 返回列名 → dataframe with 品名 + 单列
 
-def load_forecast_files(files: dict) -> dict[str, pd.DataFrame]:
+# 并行解析的进程启动方式；Streamlit 服务进程是多线程的，fork 不安全，默认使用 spawn
+FORECAST_LOAD_START_METHOD = os.environ.get("FORECAST_LOAD_START_METHOD", "spawn")
+# 默认的解析进程数上限（workers=None 时取 CPU 核数与该值的较小者）；多个会话同时解析时避免占满全部核
+FORECAST_LOAD_MAX_WORKERS = int(os.environ.get("FORECAST_LOAD_MAX_WORKERS", 4))
+
+
+def load_forecast_files_parallel(files, max_workers: int = None, backend: str = None) -> tuple[dict[str, pd.DataFrame], dict[str, tuple[str, str]]]:
+    """
+    在进程池中并行解析多个预测文件，每个文件一个任务。
+    先在本进程查解析缓存，只把未命中的文件发送到进程池；未命中不超过一个时不启动进程池。
+    结果顺序与上传顺序一致，与子进程完成的先后无关。
+    返回值：(dict[file_name -> DataFrame], dict[file_name -> (级别, 提示信息)])
+    """
+    outcomes = {}
+    misses = []
+    for uploaded_file in files:
+        content = file_bytes(uploaded_file)
+        cached = lookup_forecast_cache(content, backend)
+        if cached is not None:
+            outcomes[uploaded_file.name] = _forecast_result(cached, uploaded_file.name)
+        else:
+            outcomes[uploaded_file.name] = None
+            misses.append((uploaded_file.name, content))
+
+    if max_workers is None:
+        max_workers = min(os.cpu_count() or 1, FORECAST_LOAD_MAX_WORKERS)
+    max_workers = max(1, min(max_workers, len(misses)))
+
+    if len(misses) <= 1 or max_workers == 1:
+        for file_name, content in misses:
+            outcomes[file_name] = _read_forecast_bytes(file_name, content, backend)
+    else:
+        ctx = multiprocessing.get_context(FORECAST_LOAD_START_METHOD)
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as pool:
+            futures = [(file_name, pool.submit(_read_forecast_bytes, file_name, content, backend)) for file_name, content in misses]
+            for file_name, future in futures:
+                try:
+                    outcomes[file_name] = future.result()
+                except Exception as e:
+                    outcomes[file_name] = (None, "error", f"❌ 无法读取文件 {file_name}: {e}")
+
+    result, errors = {}, {}
+    for file_name, (df, level, message) in outcomes.items():
+        if df is None:
+            errors[file_name] = (level, message)
+        else:
+            result[file_name] = df
+    return result, errors
+
+
+def load_forecast_files(files: dict, backend: str = None, workers: int = 1) -> dict[str, pd.DataFrame]:
     """
     对上传的多个预测 Excel 文件执行以下操作：
-    - 找到每个文件中最长的 sheet
-    - 自动识别 header 行（含“产品型号”的那一行）
+    - 找到每个文件中最长的 sheet（读取元数据，不解析内容）
+    - 自动识别 header 行（前若干行中含“产品型号”的那一行）
     - 将第二列统一命名为“品名”
-    - 用 st.write 打印每个文件读取结果
+    - 读取信息（sheet、header 行、读取后端）记录在 df.attrs["reader"]
+    workers > 1（或为 None 表示按 CPU 核数，最多 FORECAST_LOAD_MAX_WORKERS）且文件多于一个时，
+    缓存未命中的文件在进程池中并行解析。
     返回值：dict[file_name -> cleaned DataFrame]
     """
-    result = {}
+    files = list(files)
 
-   
+    if (workers is None or workers > 1) and len(files) > 1:
+        result, errors = load_forecast_files_parallel(files, max_workers=workers, backend=backend)
+        for level, message in errors.values():
+            notify(level, message)
+        return result
 
+    result = {}
     for uploaded_file in files:
         file_name = uploaded_file.name
-        try:
-            xls = pd.ExcelFile(uploaded_file)
-            longest_sheet = max(xls.sheet_names, key=lambda name: pd.read_excel(xls, sheet_name=name).shape[0])
-            df_raw = pd.read_excel(xls, sheet_name=longest_sheet, header=None)
-
-            # 自动识别 header 行：包含“产品型号”的行
-            header_row_idx = df_raw[df_raw.apply(lambda row: row.astype(str).str.contains("产品型号").any(), axis=1)].index
-            if header_row_idx.empty:
-                st.warning(f"⚠ 文件 {file_name} 中未找到包含“产品型号”的表头行，跳过")
-                continue
-
-            header_row = header_row_idx[0]
-            df = pd.read_excel(xls, sheet_name=longest_sheet, header=header_row)
+        df, level, message = _read_one_forecast(uploaded_file, file_name, backend)
+        if df is None:
+            notify(level, message)
+            continue
 
-            # 统一第二列为“品名”
-            if df.shape[1] >= 2:
-                df.columns.values[1] = "品名"
+        # st.write(f"📄 读取成功：{file_name}（使用 sheet：{df.attrs['reader']['sheet']}，后端：{df.attrs['reader']['backend']}）")
+        # st.dataframe(df)
 
-            # st.write(f"📄 读取成功：{file_name}（使用 sheet：{longest_sheet}，header 行：第 {header_row+1} 行）")
-            # st.dataframe(df)
-
-            result[file_name] = df
-
-        except Exception as e:
-            st.error(f"❌ 无法读取文件 {file_name}: {e}")
+        result[file_name] = df
 
     return result
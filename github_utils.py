@@ -1,108 +1,312 @@
-from io import BytesIO
 import base64
-import requests
+import hashlib
+import os
+import threading
+import time
 import streamlit as st
-import pandas as pd
 from urllib.parse import quote
+from parse_cache import read_excel_cached, file_bytes
+from http_fetch import get_fetcher, FETCH_STALE, HTTP_TIMEOUT
+from artifact_store import get_artifact_store
 
 # GitHub 配置
 GITHUB_TOKEN_KEY = "GITHUB_TOKEN"  # secrets.toml 中的密钥名
 REPO_NAME = "TTTriste06/Forecast-Analysis"
 BRANCH = "main"
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+
+# 未上传文件时使用的默认文件
+FALLBACK_URLS = {
+    "template": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/预测分析.xlsx",
+    "forecast": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/预测.xlsx",
+    "order": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/未交订单.xlsx",
+    "sales": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/出货明细.xlsx",
+    "mapping": "https://raw.githubusercontent.com/TTTriste06/operation_planning-/main/新旧料号.xlsx"
+}
+
+# 后台上传失败时的最大尝试次数与首次退避秒数
+UPLOAD_MAX_ATTEMPTS = 4
+UPLOAD_BACKOFF_SECONDS = 2.0
+
+# 本进程内最近一次成功上传（或确认一致）的 blob SHA，相同内容再次上传时无需请求远端
+_last_uploaded_sha = {}
 
 FILENAME_KEYS = {
     "forecast": "预测.xlsx",
     "order": "未交订单.xlsx",
     "sales": "出货明细.xlsx",
-    "template": "预测分析.xlsx"
+    "template": "预测分析.xlsx",
+    "mapping": "新旧料号.xlsx"
 }
 
-def upload_to_github(file_obj, filename):
+def git_blob_sha(content: bytes) -> str:
+    """按 git 的规则计算 blob SHA（与 contents API 返回的 sha 一致）"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def _upload_content(content: bytes, filename: str, token: str) -> str:
     """
-    将 file_obj 文件上传至 GitHub 指定仓库
+    上传一次：先取远端 sha，与本地 blob SHA 相同时跳过 PUT。
+    返回 "skipped" / "uploaded"；失败时抛出异常（由上传队列重试）。
     """
-    token = st.secrets[GITHUB_TOKEN_KEY]
-    safe_filename = quote(filename)  # 支持中文
+    local_sha = git_blob_sha(content)
+    if _last_uploaded_sha.get(filename) == local_sha:
+        return "skipped"
 
-    url = f"https://api.github.com/repos/{REPO_NAME}/contents/{safe_filename}"
+    url = f"{GITHUB_API_URL}/repos/{REPO_NAME}/contents/{quote(filename)}"
     headers = {
         "Authorization": f"token {token}",
         "Accept": "application/vnd.github.v3+json"
     }
-
-    file_obj.seek(0)
-    content = base64.b64encode(file_obj.read()).decode("utf-8")
-    file_obj.seek(0)
+    session = get_fetcher().session
 
     # 检查是否已存在
     sha = None
-    get_resp = requests.get(url, headers=headers)
+    get_resp = session.get(url, headers=headers, params={"ref": BRANCH}, timeout=HTTP_TIMEOUT)
     if get_resp.status_code == 200:
         sha = get_resp.json().get("sha")
+    if sha == local_sha:
+        _last_uploaded_sha[filename] = local_sha
+        return "skipped"
 
     payload = {
         "message": f"upload {filename}",
-        "content": content,
+        "content": base64.b64encode(content).decode("utf-8"),
         "branch": BRANCH
     }
     if sha:
         payload["sha"] = sha
 
-    put_resp = requests.put(url, headers=headers, json=payload)
+    put_resp = session.put(url, headers=headers, json=payload, timeout=HTTP_TIMEOUT)
     if put_resp.status_code not in [200, 201]:
         raise Exception(f"❌ 上传失败：{put_resp.status_code} - {put_resp.text}")
+    _last_uploaded_sha[filename] = local_sha
+    return "uploaded"
 
 
-def download_from_github(filename):
+class UploadQueue:
+    """
+    后台上传队列：单个工作线程按顺序上传，失败按指数退避重试；
+    同一文件名排队中的旧版本会被新版本替换，只上传最新内容。
+    每次提交记录提交方（会话 ID），失败只通知该提交方一次。
+    """
+    def __init__(self, max_attempts: int = UPLOAD_MAX_ATTEMPTS, backoff: float = UPLOAD_BACKOFF_SECONDS):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.status = {}  # {文件名: (状态, 说明, 提交方)}
+        self._pending = {}  # {文件名: (内容, token, 提交方)}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+
+    def submit(self, content: bytes, filename: str, token: str, owner: str = None):
+        with self._lock:
+            self._pending[filename] = (content, token, owner)
+            self.status[filename] = ("pending", "", owner)
+            self._idle.clear()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="github-upload", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def join(self, timeout: float = None) -> bool:
+        """等待队列清空；返回是否在超时前完成"""
+        return self._idle.wait(timeout)
+
+    def pop_failures(self, owner: str) -> list[tuple[str, str]]:
+        """取出并清除该提交方的上传失败 [(文件名, 说明)]，每个失败只返回一次"""
+        with self._lock:
+            failed = [
+                filename for filename, (state, _, entry_owner) in self.status.items()
+                if state == "failed" and entry_owner == owner
+            ]
+            return [(filename, self.status.pop(filename)[1]) for filename in failed]
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                if not self._pending:
+                    self._wakeup.clear()
+                    self._idle.set()
+                    continue
+                filename, (content, token, owner) = next(iter(self._pending.items()))
+                del self._pending[filename]
+            self._upload_with_retry(content, filename, token, owner)
+
+    def _set_status(self, filename: str, state: str, message: str, owner: str):
+        # 排队期间又提交了新版本时，以新版本的状态为准
+        with self._lock:
+            if filename not in self._pending:
+                self.status[filename] = (state, message, owner)
+
+    def _upload_with_retry(self, content: bytes, filename: str, token: str, owner: str):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = _upload_content(content, filename, token)
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self._set_status(filename, "failed", str(e), owner)
+                    return
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+                continue
+            self._set_status(filename, result, "", owner)
+            return
+
+
+_upload_queue = UploadQueue()
+
+
+def pop_upload_failures() -> list[tuple[str, str]]:
+    """当前会话提交、且多次重试仍失败的上传 [(文件名, 说明)]；取出后不再返回"""
+    return _upload_queue.pop_failures(_session_id())
+
+
+def _session_id():
+    """当前 Streamlit 会话 ID；不在会话中（如命令行）时为 None"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def upload_to_github(file_obj, filename, wait: bool = False):
     """
-    从 GitHub 下载文件内容（二进制返回）
+    将 file_obj 文件上传至 GitHub 指定仓库。
+    本地计算 git blob SHA，与远端一致时不再上传；默认放入后台队列（失败自动重试），不阻塞主流程。
+    wait=True 时同步上传并在失败时抛出异常。
     """
     token = st.secrets[GITHUB_TOKEN_KEY]
+    content = file_bytes(file_obj)
+    if wait:
+        return _upload_content(content, filename, token)
+    _upload_queue.submit(content, filename, token, owner=_session_id())
+
+
+def download_from_github(filename):
+    """
+    从 GitHub 下载文件内容（二进制返回）。
+    使用 raw 媒体类型直接取文件字节，不经过 JSON + base64，且支持 1 MB 以上的文件。
+    """
     safe_filename = quote(filename)
 
-    url = f"https://api.github.com/repos/{REPO_NAME}/contents/{safe_filename}?ref={BRANCH}"
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json"
-    }
+    url = f"{GITHUB_API_URL}/repos/{REPO_NAME}/contents/{safe_filename}?ref={BRANCH}"
+    headers = {"Accept": "application/vnd.github.raw"}
+    try:
+        headers["Authorization"] = f"token {st.secrets[GITHUB_TOKEN_KEY]}"
+    except (KeyError, FileNotFoundError):
+        pass  # 未配置 token 时匿名访问（公开仓库）
 
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        json_resp = response.json()
-        return base64.b64decode(json_resp["content"])
-    else:
-        raise FileNotFoundError(f"❌ GitHub 上找不到文件：{filename} (HTTP {response.status_code})")
+    # 条件请求：内容未变化时 GitHub 返回 304，直接使用本地副本
+    try:
+        content, status = get_fetcher().fetch(url, headers=headers)
+    except ConnectionError as e:
+        raise FileNotFoundError(f"❌ GitHub 上找不到文件：{filename} ({e})") from e
+    if status == FETCH_STALE:
+        st.warning(f"⚠️ 无法连接 GitHub，使用本地缓存的 {filename}")
+    return content
 
 
-def load_file_with_github_fallback(file_key, uploaded_file, sheet_name=0, header=0):
-    fallback_urls = {
-        "template": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/预测分析.xlsx",
-        "forecast": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/预测.xlsx",
-        "order": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/未交订单.xlsx",
-        "sales": "https://raw.githubusercontent.com/TTTriste06/forecast-analysis/main/出货明细.xlsx",
-        "mapping": "https://raw.githubusercontent.com/TTTriste06/operation_planning-/main/新旧料号.xlsx"
-    }
+class GitHubArtifactStore:
+    """GitHub 仓库作为存储后端（见 artifact_store）：写入进入后台上传队列，读取走 contents API"""
+    def put(self, name: str, file_obj):
+        upload_to_github(file_obj, name)
 
-    if uploaded_file is not None:
-        # ✅ 自动上传新文件到 GitHub
-        filename = FILENAME_KEYS.get(file_key)
-        if filename:
-            upload_to_github(uploaded_file, filename)
+    def get(self, name: str) -> bytes:
+        return download_from_github(name)
 
-        # ✅ 返回本地上传的文件内容
-        return pd.read_excel(uploaded_file, sheet_name=sheet_name, header=header, engine="openpyxl")
 
-    # fallback 下载
-    if file_key not in fallback_urls:
+def _restore_from_store(file_key):
+    """通过存储后端的 get 取回上次上传的文件内容；存储中没有时返回 None（由调用方下载默认文件）"""
+    filename = FILENAME_KEYS.get(file_key)
+    if filename is None:
+        return None
+    try:
+        return get_artifact_store().get(filename)
+    except FileNotFoundError:
+        return None
+
+
+def _restore_many_from_store(file_keys) -> dict:
+    """并发取回多个文件 {file_key: 内容或 None}；工作线程挂上当前会话的上下文，以便显示提示"""
+    from concurrent.futures import ThreadPoolExecutor
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+    file_keys = list(file_keys)
+    if not file_keys:
+        return {}
+    ctx = get_script_run_ctx(suppress_warning=True)
+    with ThreadPoolExecutor(
+        max_workers=len(file_keys),
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx) if ctx is not None else None
+    ) as executor:
+        futures = {key: executor.submit(_restore_from_store, key) for key in file_keys}
+        return {key: future.result() for key, future in futures.items()}
+
+
+def _fetch_fallback(file_key):
+    """下载默认文件（条件请求 + 本地缓存），返回内容字节"""
+    if file_key not in FALLBACK_URLS:
         raise ValueError(f"⚠️ 未识别的辅助文件类型：{file_key}")
+    url = FALLBACK_URLS[file_key]
+    try:
+        content, status = get_fetcher().fetch(url)
+    except ConnectionError as e:
+        raise ValueError(f"❌ 无法从 GitHub 获取文件：{url}") from e
+    if status == FETCH_STALE:
+        st.warning(f"⚠️ 无法连接 GitHub，{file_key} 使用上次下载的本地副本")
+    return content
 
-    url = fallback_urls[file_key]
-    response = requests.get(url)
-    if not response.ok:
-        raise ValueError(f"❌ 无法从 GitHub 获取文件：{url}")
 
-    content = response.content
+def _read_fallback_content(content, sheet_name, header):
     try:
-        return pd.read_excel(BytesIO(content), sheet_name=sheet_name, header=header, engine="openpyxl")
+        return read_excel_cached(content, sheet_name=sheet_name, header=header, engine="openpyxl")
     except Exception as e:
         raise ValueError(f"❌ 无法读取 Excel 文件（可能不是 .xlsx 格式）：{e}")
+
+
+def load_file_with_github_fallback(file_key, uploaded_file, sheet_name=0, header=0):
+    if uploaded_file is not None:
+        # ✅ 自动保存新文件到存储后端（默认 GitHub，后台上传）
+        filename = FILENAME_KEYS.get(file_key)
+        if filename:
+            get_artifact_store().put(filename, uploaded_file)
+
+        # ✅ 返回本地上传的文件内容
+        return read_excel_cached(uploaded_file, sheet_name=sheet_name, header=header, engine="openpyxl")
+
+    # ✅ 优先使用存储中上次上传的文件，其次下载默认文件
+    restored = _restore_from_store(file_key)
+    if restored is not None:
+        return _read_fallback_content(restored, sheet_name, header)
+    return _read_fallback_content(_fetch_fallback(file_key), sheet_name, header)
+
+
+def load_files_with_github_fallback(files: dict) -> dict:
+    """
+    批量版 load_file_with_github_fallback：files 为 {file_key: (uploaded_file, read_kwargs)}，
+    未上传且存储中没有的文件并发下载默认文件，返回 {file_key: DataFrame}。
+    """
+    restored = _restore_many_from_store(key for key, (uploaded_file, _) in files.items() if uploaded_file is None)
+    missing = {key: FALLBACK_URLS[key] for key, (uploaded_file, _) in files.items()
+               if uploaded_file is None and restored[key] is None and key in FALLBACK_URLS}
+    fetched = get_fetcher().fetch_many(missing)
+
+    result = {}
+    for key, (uploaded_file, read_kwargs) in files.items():
+        if uploaded_file is None and restored[key] is not None:
+            result[key] = _read_fallback_content(restored[key], read_kwargs.get("sheet_name", 0), read_kwargs.get("header", 0))
+            continue
+        if key not in fetched:
+            result[key] = load_file_with_github_fallback(key, uploaded_file, **read_kwargs)
+            continue
+        outcome = fetched[key]
+        if isinstance(outcome, Exception):
+            raise ValueError(f"❌ 无法从 GitHub 获取文件：{missing[key]}") from outcome
+        content, status = outcome
+        if status == FETCH_STALE:
+            st.warning(f"⚠️ 无法连接 GitHub，{key} 使用上次下载的本地副本")
+        result[key] = _read_fallback_content(content, read_kwargs.get("sheet_name", 0), read_kwargs.get("header", 0))
+    return result
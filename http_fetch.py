@@ -0,0 +1,135 @@
+"""
+带本地缓存的条件 HTTP 下载：
+- 复用连接池的 requests.Session（含重试）
+- 按 ETag / Last-Modified 发送 If-None-Match / If-Modified-Since，未变化的文件只返回 304
+- 每个 URL 在磁盘上保留最近一次成功下载的副本，远端不可用时回退到该副本
+不依赖 streamlit，可在线程中并发使用。
+"""
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CACHE_DIR = os.environ.get(
+    "FORECAST_HTTP_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "http")
+)
+HTTP_TIMEOUT = float(os.environ.get("FORECAST_HTTP_TIMEOUT", 30))
+HTTP_POOL_SIZE = 8
+
+# fetch 返回的状态
+FETCH_DOWNLOADED = "downloaded"      # 200，已更新本地副本
+FETCH_NOT_MODIFIED = "not_modified"  # 304，使用本地副本
+FETCH_STALE = "stale"                # 请求失败，回退到上次成功的本地副本
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def make_session(pool_size: int = HTTP_POOL_SIZE, retries: int = 2) -> requests.Session:
+    """带连接池和 GET 重试（连接错误、5xx）的 Session"""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CachedFetcher:
+    def __init__(self, cache_dir: str = HTTP_CACHE_DIR, session: requests.Session = None, timeout: float = HTTP_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.session = session or make_session()
+        self.timeout = timeout
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".bin", base + ".json"
+
+    def cached(self, url: str):
+        """返回 (内容, 元数据)；无本地副本时返回 (None, {})"""
+        content_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(content_path, "rb") as f:
+                return f.read(), meta
+        except (OSError, ValueError):
+            return None, {}
+
+    def _store(self, url: str, content: bytes, response: requests.Response):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        content_path, meta_path = self._paths(url)
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        _write_atomic(content_path, content)
+        _write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def fetch(self, url: str, headers: dict = None):
+        """
+        条件下载 url，返回 (内容字节, 状态)，状态为 FETCH_DOWNLOADED / FETCH_NOT_MODIFIED / FETCH_STALE。
+        请求失败且没有本地副本时抛出 ConnectionError。
+        """
+        cached_content, meta = self.cached(url)
+        request_headers = dict(headers or {})
+        if cached_content is not None:
+            if meta.get("etag"):
+                request_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                request_headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=request_headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            if cached_content is not None:
+                return cached_content, FETCH_STALE
+            raise ConnectionError(f"❌ 无法下载 {url}：{e}") from e
+
+        if response.status_code == 304 and cached_content is not None:
+            return cached_content, FETCH_NOT_MODIFIED
+        if response.ok:
+            self._store(url, response.content, response)
+            return response.content, FETCH_DOWNLOADED
+        if cached_content is not None:
+            return cached_content, FETCH_STALE
+        raise ConnectionError(f"❌ 无法下载 {url}（HTTP {response.status_code}）")
+
+    def fetch_many(self, urls: dict, headers: dict = None, max_workers: int = HTTP_POOL_SIZE) -> dict:
+        """
+        并发下载 {键: url}，返回 {键: (内容, 状态) 或 异常}；单个失败不影响其他。
+        """
+        def fetch_one(url):
+            try:
+                return self.fetch(url, headers=headers)
+            except Exception as e:
+                return e
+
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+            futures = {key: executor.submit(fetch_one, url) for key, url in urls.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+
+_default_fetcher = None
+
+
+def get_fetcher() -> CachedFetcher:
+    """进程内共享的默认下载器（共享连接池与磁盘缓存）"""
+    global _default_fetcher
+    if _default_fetcher is None:
+        _default_fetcher = CachedFetcher()
+    return _default_fetcher
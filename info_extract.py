@@ -4,6 +4,8 @@ import streamlit as st
 from datetime import datetime
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.utils import get_column_letter
 
 
 import pandas as pd
@@ -83,136 +85,68 @@ def extract_all_year_months(forecast_dfs: dict[str, pd.DataFrame], df_order, df_
 
     return full_months
 
-def fill_forecast_data(main_df: pd.DataFrame, forecast_dfs: dict[str, pd.DataFrame]) -> pd.DataFrame:
-    """
-    从 forecast_dfs 中提取所有“x月的预测”列，按品名写入 main_df 中。
-    不合并同月不同文件的预测，而是生成多个独立列。
-    """
-    month_pattern = re.compile(r"^(\d{4})[-年](\d{1,2})月的预测$")
-
-    for file_name, df in forecast_dfs.items():
-        if df.shape[1] < 2:
-            continue
+def aggregate_order_data(df_order) -> pd.Series:
+    """按“客户要求交期”所在月份汇总每个品名的订单数量，返回以 (品名, 年月) 为索引的 Series"""
+    months = pd.to_datetime(df_order["客户要求交期"], errors="coerce").dt.to_period("M").astype(str)
+    qty = pd.to_numeric(df_order["订单数量"], errors="coerce").fillna(0)
+    return qty.groupby([df_order["品名"], months.rename("年月")], observed=True).sum()
 
-        # 第2列作为品名列
-        name_col = df.columns[1]
-        df["品名"] = df[name_col].astype(str).str.strip()
+def aggregate_sales_data(df_sales) -> pd.Series:
+    """按“交易日期”所在月份汇总每个品名的出货数量，返回以 (品名, 年月) 为索引的 Series"""
+    months = pd.to_datetime(df_sales["交易日期"], errors="coerce").dt.to_period("M").astype(str)
+    qty = pd.to_numeric(df_sales["数量"], errors="coerce").fillna(0)
+    return qty.groupby([df_sales["品名"], months.rename("年月")], observed=True).sum()
 
-        for col in df.columns:
-            match = month_pattern.match(str(col).strip())
-            if not match:
-                continue
 
-            # 构造唯一列名：文件名-列名
-            clean_col_name = f"{file_name}-{col}".replace(".xlsx", "").replace(".xls", "").strip()
-            if clean_col_name not in main_df.columns:
-                main_df[clean_col_name] = 0
+# 预测>0 且 订单=0 的标红底色
+HIGHLIGHT_FILL = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+FORECAST_GENERATION_PATTERN = re.compile(r"^(\d{4}-\d{2})的预测（(\d{4}-\d{2})生成）$")
+ORDER_HEADER_PATTERN = re.compile(r"^(\d{4}-\d{2})-订单$")
 
-            # 提取并映射
-            forecast_series = df[["品名", col]].dropna().groupby("品名")[col].sum(min_count=1)
-            main_df[clean_col_name] = main_df["品名"].map(forecast_series).fillna(0)
 
-    return main_df
-
-
-
-
-def fill_order_data(main_df, df_order, forecast_months):
+def detect_forecast_order_pairs(header: list) -> list[tuple[int, int]]:
     """
-    将订单数据按“订单日期”和“品名”聚合并填入 main_df 中每月的“订单”列。
-    
-    参数：
-    - main_df: 主计划 DataFrame，需包含“品名”列
-    - df_order: 上传的未交订单 DataFrame，包含“订单日期”和“品名”
-    - forecast_months: 所有涉及的 yyyy-mm 字符串列表
+    找出表头中的“预测/订单”列对，返回 [(预测列, 订单列)]，列号从 1 开始。
+    - “yyyy-mm-订单”与同月“yyyy-mm的预测（yyyy-mm生成）”中生成月份最新的一列配对（按解析出的生成月份，与列位置无关）
+    - 旧格式“x月预测”没有生成月份，仍与紧随其后的订单列配对
     """
-    df_order = df_order.copy()
-
-    # 确保日期字段为 datetime 类型
-    df_order["客户要求交期"] = pd.to_datetime(df_order["客户要求交期"], errors="coerce")
-    df_order["年月"] = df_order["客户要求交期"].dt.to_period("M").astype(str)
+    names = [str(h).strip() for h in header]
+    latest = {}  # 预测月份 -> (生成月份, 列号)
+    for col_idx, name in enumerate(names, 1):
+        match = FORECAST_GENERATION_PATTERN.match(name)
+        if match:
+            month, generation = match.groups()
+            if month not in latest or generation > latest[month][0]:
+                latest[month] = (generation, col_idx)
 
-    # 数值字段清洗
-    df_order["订单数量"] = pd.to_numeric(df_order["订单数量"], errors="coerce").fillna(0)
-
-    # 聚合出每品名每月的订单量
-    grouped = (
-        df_order.groupby(["品名", "年月"])["订单数量"]
-        .sum()
-        .unstack()
-        .fillna(0)
-    )
-
-    for ym in forecast_months:
-        colname = f"{ym}-订单"
-        if colname in main_df.columns and ym in grouped.columns:
-            main_df[colname] = main_df["品名"].map(grouped[ym]).fillna(0)
+    column_pairs = []
+    for col_idx, name in enumerate(names, 1):
+        match = ORDER_HEADER_PATTERN.match(name)
+        if match and match.group(1) in latest:
+            column_pairs.append((latest[match.group(1)][1], col_idx))
+        elif name.endswith("订单") and col_idx > 1 and names[col_idx - 2].endswith("预测"):
+            column_pairs.append((col_idx - 1, col_idx))
+    return column_pairs
 
-    return main_df
 
-def fill_sales_data(main_df, df_sales, forecast_months):
+def add_forecast_order_highlight(ws, column_pairs: list[tuple[int, int]], first_row: int, last_row: int):
     """
-    将出货数据按“交易日期”和“品名”聚合并填入 main_df 中每月的“出货”列。
-    
-    参数：
-    - main_df: 主计划 DataFrame，需包含“品名”列
-    - df_sales: 出货明细 DataFrame，包含“交易日期”和“品名”
-    - forecast_months: 所有涉及的 yyyy-mm 字符串列表
+    为每个“预测/订单”列对添加一条条件格式：预测>0 且 订单为空或 0 时，两列同时标红（两列不必相邻）。
+    规则按列区域添加，由 Excel 打开时计算，不逐个单元格写底色；write-only 工作表同样适用。
     """
-    df_sales = df_sales.copy()
-
-    # 确保交易日期为 datetime
-    df_sales["交易日期"] = pd.to_datetime(df_sales["交易日期"], errors="coerce")
-    df_sales["年月"] = df_sales["交易日期"].dt.to_period("M").astype(str)
-
-    # 数值字段清洗
-    df_sales["数量"] = pd.to_numeric(df_sales["数量"], errors="coerce").fillna(0)
+    if last_row < first_row:
+        return
+    for forecast_col, order_col in column_pairs:
+        forecast_letter = get_column_letter(forecast_col)
+        order_letter = get_column_letter(order_col)
+        cell_range = f"{forecast_letter}{first_row}:{forecast_letter}{last_row} {order_letter}{first_row}:{order_letter}{last_row}"
+        formula = f'AND(N(${forecast_letter}{first_row})>0,OR(${order_letter}{first_row}="",${order_letter}{first_row}=0))'
+        ws.conditional_formatting.add(cell_range, FormulaRule(formula=[formula], fill=HIGHLIGHT_FILL))
 
-    # 聚合：每品名每月出货数量
-    grouped = (
-        df_sales.groupby(["品名", "年月"])["数量"]
-        .sum()
-        .unstack()
-        .fillna(0)
-    )
-
-    for ym in forecast_months:
-        colname = f"{ym}-出货"
-        if colname in main_df.columns and ym in grouped.columns:
-            main_df[colname] = main_df["品名"].map(grouped[ym]).fillna(0)
-
-    return main_df
 
 def highlight_by_detecting_column_headers(ws):
     """
-    自动识别表头第二行中连续的“预测/订单”列对，并对值为：预测>0且订单=0 的单元格标红。
+    自动识别表头第二行中的“预测/订单”列对，并对值为：预测>0且订单=0 的单元格标红（条件格式）。
     """
-    red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-    max_col = ws.max_column
-    max_row = ws.max_row
-
     header = [cell.value for cell in ws[2]]
-
-    # 遍历所有列找出“预测-订单”成对列索引
-    column_pairs = []
-    for i in range(len(header) - 1):
-        name1 = str(header[i]).strip()
-        name2 = str(header[i + 1]).strip()
-        if name1.endswith("预测") and name2.endswith("订单"):
-            column_pairs.append((i + 1, i + 2))  # openpyxl列从1开始
-
-    # 遍历每行，检查成对列
-    for row in range(3, ws.max_row + 1):
-        for forecast_col, order_col in column_pairs:
-            cell_forecast = ws.cell(row=row, column=forecast_col)
-            cell_order = ws.cell(row=row, column=order_col)
-
-            try:
-                val_forecast = float(cell_forecast.value or 0)
-                val_order = float(cell_order.value or 0)
-            except:
-                continue
-
-            if val_forecast > 0 and val_order == 0:
-                cell_forecast.fill = red_fill
-                cell_order.fill = red_fill
+    add_forecast_order_highlight(ws, detect_forecast_order_pairs(header), 3, ws.max_row)
@@ -4,31 +4,143 @@ from datetime import datetime
 from io import BytesIO
 from ui import get_uploaded_files
 from pivot_processor import PivotProcessor
-from github_utils import load_file_with_github_fallback
+from github_utils import load_files_with_github_fallback, pop_upload_failures
+from snapshot_store import ForecastSnapshotStore
+from parse_cache import frame_version, file_bytes
+from columnar_export import COLUMNAR_FORMATS, LazyExports
+from result_cache import get_result_cache
+from result_viewer import PlanIndex, show_plan_viewer
+import hashlib
+
+
+def input_signature(forecast_files, order_df, sales_df, snapshot_signature) -> tuple:
+    """
+    除新旧料号以外的输入指纹（含快照库内容，未启用快照时为 None）；
+    与已缓存的处理器一致时只需按新旧料号增量更新
+    """
+    forecast_sig = tuple((f.name, hashlib.sha256(file_bytes(f)).hexdigest()) for f in forecast_files or [])
+    return forecast_sig, frame_version(order_df), frame_version(sales_df), snapshot_signature
+
+
+@st.fragment(run_every=1)
+def wait_for_excel():
+    """后台 Excel 生成期间每秒检查一次；完成后整页重跑，显示可用的下载按钮"""
+    job = st.session_state.get("excel_job")
+    if job is None or job.done():
+        st.rerun()
+    st.download_button(label="⏳ Excel 文件生成中…", data=b"", disabled=True, key="download_excel_pending")
+
+
+def excel_download_button():
+    """
+    Excel 在后台生成；完成前按钮不可用。生成结果只保存在结果缓存的任务中（各会话共用、计入内存预算），
+    点击下载时才取出字节，会话中不另存副本
+    """
+    job = st.session_state.get("excel_job")
+    if job is None:
+        return
+    if not job.done():
+        wait_for_excel()
+        return
+    if job.exception() is not None:
+        st.error(f"❌ Excel 生成失败: {job.exception()}")
+        return
+
+    st.download_button(
+        label="📥 下载主计划 Excel 文件",
+        data=lambda: job.result().getvalue(),
+        file_name=f"预测分析主计划_{st.session_state['result_timestamp']}.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        key="download_excel"
+    )
+
+
+def show_result():
+    """展示会话中保存的最近一次结果（主计划表格 + 下载）"""
+    timestamp = st.session_state["result_timestamp"]
+
+    st.success("✅ 主计划生成成功！")
+    # ✅ 主计划留在服务器端，分页、筛选后只发送当前页；控件键随结果变化，不沿用上一份结果的筛选值
+    show_plan_viewer(st.session_state["plan_index"], key=f"plan_viewer_{timestamp}")
+
+    excel_download_button()
+
+    # ✅ 上传文件在后台同步到 GitHub，多次重试仍失败时提示
+    for filename, message in pop_upload_failures():
+        st.warning(f"⚠️ {filename} 上传 GitHub 失败（不影响本次计算）：{message}")
+
+    # ✅ 列式格式：只导出所选的表和格式，点击下载时才生成（在下载回调线程中执行），字节随结果缓存
+    exports = st.session_state["columnar_exports"]
+    with st.expander("📦 其他格式下载（Parquet / Arrow / CSV）"):
+        table_col, format_col, button_col = st.columns(3)
+        table = table_col.selectbox("表", list(exports.tables), key="columnar_table")
+        fmt = format_col.selectbox("格式", list(COLUMNAR_FORMATS), key="columnar_format")
+        button_col.download_button(
+            label=f"📥 下载 {table}.{COLUMNAR_FORMATS[fmt]}",
+            data=lambda: exports.file(table, fmt),
+            file_name=f"{table}_{timestamp}.{COLUMNAR_FORMATS[fmt]}",
+            mime="application/octet-stream",
+            key="download_columnar"
+        )
+
 
 def main():
     st.set_page_config(page_title="预测分析主计划工具", layout="wide")
     st.title("📊 预测分析主计划生成器")
     
-    forecast_files, order_file, sales_file, mapping_file, start = get_uploaded_files()
+    forecast_files, order_file, sales_file, mapping_file, use_snapshots, start = get_uploaded_files()
     
     if start:    
-        order_df = load_file_with_github_fallback("order", order_file, sheet_name="Sheet")
-        sales_df = load_file_with_github_fallback("sales", sales_file, sheet_name="原表")
-        mapping_df = load_file_with_github_fallback("mapping", mapping_file, sheet_name=0)
-    
-        processor = PivotProcessor()
-        df_result, excel_output = processor.process(forecast_files, order_df, sales_df, mapping_df)
-    
-        st.success("✅ 主计划生成成功！")
-        st.dataframe(df_result, use_container_width=True)
+        # ✅ 未上传的文件并发从 GitHub 下载（条件请求 + 本地缓存）
+        inputs = load_files_with_github_fallback({
+            "order": (order_file, {"sheet_name": "Sheet"}),
+            "sales": (sales_file, {"sheet_name": "原表"}),
+            "mapping": (mapping_file, {"sheet_name": 0}),
+        })
+        order_df, sales_df, mapping_df = inputs["order"], inputs["sales"], inputs["mapping"]
     
-        st.download_button(
-            label="📥 下载主计划 Excel 文件",
-            data=excel_output.getvalue(),
-            file_name=f"预测分析主计划_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        # ✅ 服务器级缓存：所有输入（含新旧料号、快照库）内容相同时，直接复用任意会话算过的结果
+        snapshot_store = ForecastSnapshotStore() if use_snapshots else None
+        snapshot_signature = snapshot_store.signature(exclude=[f.name for f in forecast_files or []]) if snapshot_store else None
+        signature = input_signature(forecast_files, order_df, sales_df, snapshot_signature)
+        cache_key = (signature, frame_version(mapping_df))
+        result_cache = get_result_cache()
+        cached = result_cache.get(cache_key) if result_cache is not None else None
+        if cached is not None and cached["excel_job"].done() and cached["excel_job"].exception() is not None:
+            cached = None  # Excel 生成失败的结果不复用，重新计算
+
+        if cached is not None:
+            st.session_state.update(cached)
+        else:
+            # ✅ 只有新旧料号变化时，复用同一组输入（含快照库）的处理器做增量更新；
+            #    处理器保存输入与未过滤的主计划，放在结果缓存中计入内存预算，不在每个会话各存一份
+            processor_key = ("processor", signature)
+            processor = result_cache.get(processor_key) if result_cache is not None else None
+            if processor is not None:
+                df_result, _ = processor.update_mapping(mapping_df, excel=False)
+            else:
+                processor = PivotProcessor(load_workers=None, snapshot_store=snapshot_store)
+                df_result, _ = processor.process(forecast_files, order_df, sales_df, mapping_df, excel=False)
+            if result_cache is not None:
+                result_cache.put(processor_key, processor)
+
+            # ✅ 表格先展示，Excel 交给后台线程生成，列式格式在下载所选表时生成；
+            #    导出使用不带计算状态的处理器（两者共用事实表），缓存条目不持有输入数据
+            exporter = PivotProcessor()
+            cached = {
+                "result": df_result,
+                "plan_index": PlanIndex(df_result),
+                "excel_job": exporter.build_excel_async(df_result),
+                "columnar_exports": LazyExports(exporter.columnar_tables(df_result)),
+            }
+            if result_cache is not None:
+                result_cache.put(cache_key, cached)
+            st.session_state.update(cached)
+
+        st.session_state["result_timestamp"] = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    if st.session_state.get("result") is not None:
+        show_result()
 
 
 if __name__ == "__main__":
@@ -1,5 +1,14 @@
 import pandas as pd
-import streamlit as st
+from notify import notify
+from parse_cache import frame_version
+from name_utils import normalize_part_key
+
+
+def mapping_version(mapping_df: pd.DataFrame) -> str:
+    """
+    新旧料号表的内容哈希，用于判断缓存、快照是否基于同一版本的映射。
+    """
+    return frame_version(mapping_df)
 
 def apply_all_name_replacements(df, mapping_new, mapping_sub, sheet_name, field_mappings, verbose=False):
     """
@@ -82,13 +91,13 @@ def replace_all_names_with_mapping(all_names: pd.Series, mapping_new: pd.DataFra
     if not isinstance(all_names, pd.Series):
         return all_names
 
-    all_names = all_names.dropna().astype(str).str.strip()
+    all_names = normalize_part_key(all_names.dropna())
 
     # 1️⃣ 新旧料号替换
     if mapping_new is not None and not mapping_new.empty:
         mapping_new = mapping_new.copy()
-        mapping_new["旧品名"] = mapping_new["旧品名"].astype(str).str.strip()
-        mapping_new["新品名"] = mapping_new["新品名"].astype(str).str.strip()
+        mapping_new["旧品名"] = normalize_part_key(mapping_new["旧品名"])
+        mapping_new["新品名"] = normalize_part_key(mapping_new["新品名"])
 
         df_names = all_names.to_frame(name="品名")
         merged = df_names.merge(
@@ -106,14 +115,14 @@ def replace_all_names_with_mapping(all_names: pd.Series, mapping_new: pd.DataFra
     # 2️⃣ 替代料号替换
     if mapping_sub is not None and not mapping_sub.empty:
         mapping_sub = mapping_sub.copy()
-        mapping_sub["新品名"] = mapping_sub["新品名"].astype(str).str.strip()
+        mapping_sub["新品名"] = normalize_part_key(mapping_sub["新品名"])
 
         for i in range(1, 5):
             sub_col = f"替代品名{i}"
             if sub_col not in mapping_sub.columns:
                 continue
 
-            mapping_sub[sub_col] = mapping_sub[sub_col].astype(str).str.strip()
+            mapping_sub[sub_col] = normalize_part_key(mapping_sub[sub_col])
 
             valid_subs = mapping_sub[
                 mapping_sub[sub_col].notna() &
@@ -140,10 +149,10 @@ def apply_mapping_and_merge(df, mapping_df, field_map, verbose=False):
     """
     name_col = field_map["品名"]
     df = df.copy()
-    df[name_col] = df[name_col].astype(str).str.strip()
+    df[name_col] = normalize_part_key(df[name_col])
     mapping_df = mapping_df.copy()
-    mapping_df["旧品名"] = mapping_df["旧品名"].astype(str).str.strip()
-    mapping_df["新品名"] = mapping_df["新品名"].astype(str).str.strip()
+    mapping_df["旧品名"] = normalize_part_key(mapping_df["旧品名"])
+    mapping_df["新品名"] = normalize_part_key(mapping_df["新品名"])
 
     # 构造旧 -> 新 的映射字典，排除新品名为空的行
     mapping_dict = dict(
@@ -158,55 +167,38 @@ def apply_mapping_and_merge(df, mapping_df, field_map, verbose=False):
     replaced_names = set(mapping_dict.values()).intersection(set(df[name_col]))
 
     if verbose:
-        st.write(f"✅ 新旧料号替换成功: {len(replaced_names)} 项")
+        notify("write", f"✅ 新旧料号替换成功: {len(replaced_names)} 项")
 
     return df, replaced_names
 
 def apply_extended_substitute_mapping(df, mapping_df, field_map, verbose=False):
     """
     替代料号品名替换（仅品名字段替换，无聚合合并）
+    用“替代品名 → 新品名”查找表对品名列做一次哈希映射，复杂度 O(行数 + 映射条数)。
+    同一替代品名出现多次时取第一条；链路（替代品名 → 新品名 → ...）最多沿用 4 次。
     """
     name_col = field_map["品名"]
     df = df.copy()
-    df[name_col] = df[name_col].astype(str).str.strip().str.replace("\n", "").str.replace("\r", "")
+    df[name_col] = _clean_name_series(df[name_col])
 
     df = df[df[name_col] != ""].copy()
 
-    # 清洗映射表中所有替代品名及新品名
-    substitute_records = []
-    for i in range(1, 5):
-        sub_name = f"替代品名"
-        for col in [sub_name, "新品名"]:
-            if col not in mapping_df.columns:
-                mapping_df[col] = ""
-            mapping_df[col] = mapping_df[col].astype(str).str.strip().str.replace("\n", "").str.replace("\r", "")
-
-        valid_rows = mapping_df[
-            mapping_df[[sub_name, "新品名"]].notna().all(axis=1) &
-            (mapping_df[sub_name] != "") &
-            (mapping_df["新品名"] != "")
-        ]
-
-        for _, row in valid_rows.iterrows():
-            substitute_records.append({
-                "旧品名": row[sub_name],
-                "新品名": row["新品名"]
-            })
+    lookup = pd.Series(_mapping_pairs(mapping_df, "替代品名", "新品名", keep="first"), dtype=object)
 
     # 替换品名
     matched_keys = set()
-    for sub in substitute_records:
-        mask = (df[name_col] == sub["旧品名"])
-        if mask.any():
-            """
-            if verbose:
-                st.write(f"🔁 替代品名: {sub['旧品名']} → {sub['新品名']}，行数: {mask.sum()}")
-            """
-            df.loc[mask, name_col] = sub["新品名"]
-            matched_keys.update(df.loc[mask, name_col])
+    names = df[name_col]
+    for _ in range(4):
+        hit = names.isin(lookup.index)
+        if not hit.any():
+            break
+        replaced = names[hit].map(lookup)
+        matched_keys.update(replaced)
+        names = names.where(~hit, replaced)
+    df[name_col] = names
 
     if verbose:
-        st.success(f"✅ 替代品名替换完成，共替换: {len(matched_keys)} 种")
+        notify("success", f"✅ 替代品名替换完成，共替换: {len(matched_keys)} 种")
 
     return df, matched_keys
 
@@ -265,3 +257,172 @@ def split_mapping_data(mapping_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataF
     return mapping_semi, mapping_new, mapping_sub
 
     
+
+
+def _clean_name_series(s: pd.Series) -> pd.Series:
+    """品名清洗：与全流程共用的品名键规范化一致"""
+    return normalize_part_key(s)
+
+
+def _mapping_pairs(mapping_df: pd.DataFrame, from_col: str, to_col: str, keep: str) -> dict:
+    """
+    从映射表中取出 from_col → to_col 的有效映射（两端均非空、非 "nan"）。
+    同一 from 出现多次时按 keep（"first"/"last"）取舍。
+    """
+    if mapping_df is None or mapping_df.empty or from_col not in mapping_df.columns or to_col not in mapping_df.columns:
+        return {}
+    pairs = pd.DataFrame({
+        "from": _clean_name_series(mapping_df[from_col]),
+        "to": _clean_name_series(mapping_df[to_col]),
+    })
+    pairs = pairs.dropna()
+    pairs = pairs[~pairs["from"].isin(["", "nan"]) & ~pairs["to"].isin(["", "nan"])]
+    pairs = pairs.drop_duplicates(subset=["from"], keep=keep)
+    return dict(zip(pairs["from"], pairs["to"]))
+
+
+class NameResolver:
+    """
+    由 split_mapping_data 的结果一次性编译出的品名解析器。
+    旧品名 → 新品名 → 替代品名 的多级链路折叠成一张“原品名 → 最终品名”查找表，
+    之后对任意品名列只需一次向量化 map。映射成环时记录在 cycles 中，环内品名保持不变。
+    """
+
+    def __init__(self, mapping_new: pd.DataFrame, mapping_sub: pd.DataFrame, version: str = None):
+        self.mapping_new = mapping_new
+        self.mapping_sub = mapping_sub
+        self.version = version
+        self.cycles = []
+
+        # 新旧料号与 dict(values) 一致取最后一条；替代料号与逐条替换一致取第一条
+        new_map = _mapping_pairs(mapping_new, "旧品名", "新品名", keep="last")
+        sub_map = _mapping_pairs(mapping_sub, "替代品名", "新品名", keep="first")
+
+        # 单步：先新旧料号、再替代料号；再把单步映射折叠到不动点
+        step = {}
+        for name in sorted(set(new_map) | set(sub_map)):
+            mid = new_map.get(name, name)
+            step[name] = sub_map.get(mid, mid)
+        lookup = self._collapse({k: v for k, v in step.items() if k != v})
+        self.lookup = pd.Series(lookup, dtype=object)
+
+        if self.cycles:
+            cycle_text = "；".join(" → ".join(cycle + cycle[:1]) for cycle in self.cycles)
+            notify("warning", f"⚠ 新旧料号/替代料号映射存在环，环内品名不做替换：{cycle_text}")
+
+    def _collapse(self, mapping: dict) -> dict:
+        """把 a→b→c 的链路折叠为 a→c、b→c；检测环"""
+        resolved = {}
+        for start in mapping:
+            path, seen, node = [], set(), start
+            while node in mapping and node not in resolved and node not in seen:
+                seen.add(node)
+                path.append(node)
+                node = mapping[node]
+            if node in seen:
+                cycle = path[path.index(node):]
+                self.cycles.append(cycle)
+                for n in cycle:
+                    resolved[n] = n
+            final = resolved.get(node, node)
+            for n in path:
+                resolved.setdefault(n, final)
+        return {k: v for k, v in resolved.items() if k != v}
+
+    def resolve(self, names: pd.Series) -> pd.Series:
+        """清洗并把品名序列解析为最终品名（不删除空值）"""
+        names = _clean_name_series(names)
+        if self.lookup.empty:
+            return names
+        return names.map(self.lookup).fillna(names)
+
+    def apply(self, df: pd.DataFrame, name_col: str, keys: pd.Series = None) -> tuple[pd.DataFrame, set]:
+        """
+        替换 df[name_col] 为最终品名，并删除品名为空的行。
+        keys 为已规范化的品名键（normalize_part_key 的结果）时不再重复清洗。
+        返回替换后的 DataFrame 和所有被替换成的新品名集合。
+        """
+        df = df.copy()
+        names = _clean_name_series(df[name_col]) if keys is None else keys
+        hit = names.isin(self.lookup.index)
+        df[name_col] = names.map(self.lookup).where(hit, names)
+        df = df[df[name_col] != ""].copy()
+        mapped_keys = set(df.loc[hit.reindex(df.index), name_col])
+        return df, mapped_keys
+
+
+# mapping_version -> NameResolver，同一份新旧料号在会话内只编译一次
+_RESOLVER_CACHE = {}
+_RESOLVER_CACHE_SIZE = 8
+
+
+def get_name_resolver(mapping_df: pd.DataFrame) -> NameResolver:
+    """
+    按新旧料号表内容哈希获取（或编译）NameResolver。
+    """
+    version = mapping_version(mapping_df)
+    resolver = _RESOLVER_CACHE.pop(version, None)
+    if resolver is None:
+        _, mapping_new, mapping_sub = split_mapping_data(mapping_df)
+        resolver = NameResolver(mapping_new, mapping_sub, version=version)
+    _RESOLVER_CACHE[version] = resolver
+    while len(_RESOLVER_CACHE) > _RESOLVER_CACHE_SIZE:
+        _RESOLVER_CACHE.pop(next(iter(_RESOLVER_CACHE)))
+    return resolver
+
+
+
+def _diff_dicts(previous: dict, current: dict) -> dict:
+    """对比两个映射字典，返回 added / removed / changed"""
+    return {
+        "added": {k: current[k] for k in current.keys() - previous.keys()},
+        "removed": {k: previous[k] for k in previous.keys() - current.keys()},
+        "changed": {k: (previous[k], current[k]) for k in previous.keys() & current.keys() if previous[k] != current[k]},
+    }
+
+
+def _new_mapping_table(mapping_new: pd.DataFrame) -> dict:
+    """旧品名 → (新品名, 新规格, 新晶圆)，与 dict(values) 一致取最后一条"""
+    if mapping_new.empty:
+        return {}
+    table = pd.DataFrame({
+        col: _clean_name_series(mapping_new[col]) for col in ["旧品名", "新品名", "新规格", "新晶圆"]
+    })
+    table = table[~table["旧品名"].isin(["", "nan"]) & table["旧品名"].notna()]
+    table = table.drop_duplicates(subset=["旧品名"], keep="last")
+    return dict(zip(table["旧品名"], zip(table["新品名"], table["新规格"], table["新晶圆"])))
+
+
+def diff_mapping_data(previous_df: pd.DataFrame, mapping_df: pd.DataFrame) -> dict:
+    """
+    对比两版新旧料号表（均先经 split_mapping_data 拆分），返回：
+    {
+        "new": {"added": {旧品名: (新品名, 新规格, 新晶圆)}, "removed": {...}, "changed": {旧品名: (上版, 本版)}},
+        "sub": {"added": {替代品名: 新品名}, "removed": {...}, "changed": {替代品名: (上版, 本版)}},
+    }
+    """
+    _, prev_new, prev_sub = split_mapping_data(previous_df)
+    _, curr_new, curr_sub = split_mapping_data(mapping_df)
+    return {
+        "new": _diff_dicts(_new_mapping_table(prev_new), _new_mapping_table(curr_new)),
+        "sub": _diff_dicts(
+            _mapping_pairs(prev_sub, "替代品名", "新品名", keep="first"),
+            _mapping_pairs(curr_sub, "替代品名", "新品名", keep="first"),
+        ),
+    }
+
+
+def mapping_diff_names(diff: dict) -> set:
+    """diff 中涉及的所有品名（旧品名、替代品名以及两版的新品名）；为空表示主计划不受影响"""
+    names = set()
+    for kind in ("new", "sub"):
+        for key, value in diff[kind]["added"].items():
+            names.add(key)
+            names.add(value[0] if kind == "new" else value)
+        for key, value in diff[kind]["removed"].items():
+            names.add(key)
+            names.add(value[0] if kind == "new" else value)
+        for key, (before, after) in diff[kind]["changed"].items():
+            names.add(key)
+            names.update((before[0], after[0]) if kind == "new" else (before, after))
+    return names
@@ -5,6 +5,44 @@ from openpyxl.styles import Font
 from openpyxl.utils.dataframe import dataframe_to_rows
 from io import BytesIO
 import re
+import numpy as np
+
+
+def normalize_part_key(names: pd.Series) -> pd.Series:
+    """
+    品名键规范化（每份输入只做一次）：
+    全角转半角（NFKC）、去掉换行/回车/制表符、压缩连续空白并去除首尾空白。
+    只对去重后的取值做字符串运算，再按整数码还原为整列。
+    """
+    codes, uniques = pd.factorize(names)
+    normalized = (
+        pd.Series(uniques, dtype=object).astype(str)
+        .str.normalize("NFKC")
+        .str.replace(r"[\r\n\t]", "", regex=True)
+        .str.replace(r"\s+", " ", regex=True)
+        .str.strip()
+        .to_numpy(dtype=object)
+    )
+    values = np.full(len(codes), np.nan, dtype=object)
+    valid = codes >= 0
+    values[valid] = normalized[codes[valid]]
+    return pd.Series(values, index=names.index, dtype=object)
+
+
+class PartKeyDictionary:
+    """
+    全流程共享的品名字典：所有数据源的品名编码为同一个 CategoricalDtype，
+    之后的去重、合并、分组和取值都基于整数码完成。
+    """
+
+    def __init__(self, *name_series: pd.Series):
+        names = pd.concat([pd.Series(s, dtype=object) for s in name_series], ignore_index=True) if name_series else pd.Series(dtype=object)
+        self.dtype = pd.CategoricalDtype(categories=pd.unique(names.dropna()))
+
+    def encode(self, names: pd.Series) -> pd.Series:
+        """把品名列编码为共享字典的 Categorical（不在字典中的品名为 NaN）"""
+        return names.astype(object).astype(self.dtype)
+
 
 def extract_unique_rows_from_all_sources(forecast_files, order_df, sales_df, mapping_df):
     from mapping_utils import (
@@ -51,14 +89,20 @@ def extract_unique_rows_from_all_sources(forecast_files, order_df, sales_df, map
 
     return result
 
-def build_main_df(forecast_dfs: dict[str, pd.DataFrame], order_df, sales_df, mapping_new, mapping_sub):
-    from mapping_utils import apply_mapping_and_merge, apply_extended_substitute_mapping
+def build_main_df(forecast_dfs: dict[str, pd.DataFrame], order_df, sales_df, mapping_new, mapping_sub, resolver=None, part_keys=None):
+    """
+    汇总所有数据源的品名，补齐规格和晶圆品名，返回主表的识别列。
+    part_keys（PartKeyDictionary）提供时，各数据源的品名已替换为最终品名并编码为共享字典的 Categorical，
+    去重与合并都基于整数码，不再重复清洗和替换。
+    """
+    from mapping_utils import NameResolver
 
     # 🧩 提取所有品名（预测每个表第2列、订单、出货）
     def extract_and_standardize(df, col):
         df = df[[col]].copy()
         df.columns = ["品名"]
-        df["品名"] = df["品名"].astype(str).str.strip()
+        if part_keys is None:
+            df["品名"] = df["品名"].astype(str).str.strip()
         return df
 
     forecast_names_list = []
@@ -74,47 +118,48 @@ def build_main_df(forecast_dfs: dict[str, pd.DataFrame], order_df, sales_df, map
 
     all_names = pd.concat([forecast_names, order_names, sales_names], ignore_index=True)
     all_names = all_names.drop_duplicates(subset=["品名"]).copy()
-    all_names["规格"] = ""
-    all_names["晶圆品名"] = ""
-
-    # ✅ 替换新旧料号（主替换 + 替代替换）
-    all_names, _ = apply_mapping_and_merge(all_names, mapping_new, {"品名": "品名"})
-    all_names, _ = apply_extended_substitute_mapping(all_names, mapping_sub, {"品名": "品名"})
-
-    # ✅ 从映射表提取规格、晶圆品名
-    mapping_clean = mapping_new[["新品名", "新规格", "新晶圆"]].copy()
-    mapping_clean = mapping_clean.rename(columns={"新品名": "品名", "新规格": "规格", "新晶圆": "晶圆品名"})
-
-    main_df = all_names.merge(mapping_clean, on="品名", how="left", suffixes=("", "_映射"))
-    main_df["规格"] = main_df["规格"].where(main_df["规格"] != "", main_df["规格_映射"])
-    main_df["晶圆品名"] = main_df["晶圆品名"].where(main_df["晶圆品名"] != "", main_df["晶圆品名_映射"])
-    main_df.drop(columns=["规格_映射", "晶圆品名_映射"], inplace=True)
-
-    # ✅ 从订单、出货、预测中依次补齐空规格和晶圆品名
-    def try_fill(df_main, df_source, col_map):
-        df_temp = df_source.rename(columns=col_map).copy()
-        for col in ["品名", "规格"]:
-            if col in df_temp.columns:
-                df_temp[col] = df_temp[col].astype(str).str.strip()
-        if "晶圆品名" in df_temp.columns:
-            df_temp["晶圆品名"] = df_temp["晶圆品名"].astype(str).str.strip()
-        elif "晶圆" in df_temp.columns:
+
+    # ✅ 替换新旧料号（主替换 + 替代替换，链路已折叠）
+    if part_keys is None:
+        if resolver is None:
+            resolver = NameResolver(mapping_new, mapping_sub)
+        all_names, _ = resolver.apply(all_names, "品名")
+        all_names = all_names.drop_duplicates(subset=["品名"])
+
+    # ✅ 规格、晶圆品名的候选来源，按优先级排列：映射表 > 订单 > 出货 > 各预测文件
+    def candidates(df_source, col_map):
+        df_temp = df_source.rename(columns=col_map)
+        if "晶圆品名" not in df_temp.columns and "晶圆" in df_temp.columns:
             df_temp = df_temp.rename(columns={"晶圆": "晶圆品名"})
-            df_temp["晶圆品名"] = df_temp["晶圆品名"].astype(str).str.strip()
-        else:
-            df_temp["晶圆品名"] = ""
-
-        df_temp = df_temp[["品名", "规格", "晶圆品名"]].dropna(subset=["品名"]).drop_duplicates(subset=["品名"])
-        df_main = df_main.merge(df_temp, on="品名", how="left", suffixes=("", "_补"))
-        df_main["规格"] = df_main["规格"].where(df_main["规格"] != "", df_main["规格_补"])
-        df_main["晶圆品名"] = df_main["晶圆品名"].where(df_main["晶圆品名"] != "", df_main["晶圆品名_补"])
-        return df_main.drop(columns=["规格_补", "晶圆品名_补"])
-
-    main_df = try_fill(main_df, order_df, {})
-    main_df = try_fill(main_df, sales_df, {"晶圆": "晶圆品名"})
-
-    for df in forecast_dfs.values():
-        main_df = try_fill(main_df, df.assign(晶圆品名=""), {"生产料号": "品名", "产品型号": "规格"})
-    main_df = main_df.drop_duplicates(subset=["晶圆品名", "规格", "品名"])
+
+        def first_col(col):
+            if col not in df_temp.columns:
+                return np.nan
+            values = df_temp[col]
+            return values.iloc[:, 0] if isinstance(values, pd.DataFrame) else values
+
+        out = pd.DataFrame({"品名": first_col("品名")})
+        out["规格"] = first_col("规格")
+        out["晶圆品名"] = first_col("晶圆品名")
+        if part_keys is None:
+            out["品名"] = normalize_part_key(out["品名"])
+        return out
+
+    mapping_clean = mapping_new[["新品名", "新规格", "新晶圆"]].rename(columns={"新品名": "品名", "新规格": "规格", "新晶圆": "晶圆品名"})
+    mapping_clean = mapping_clean.assign(品名=normalize_part_key(mapping_clean["品名"]))
+    if part_keys is not None:
+        mapping_clean["品名"] = part_keys.encode(mapping_clean["品名"])
+
+    sources = [mapping_clean, candidates(order_df, {}), candidates(sales_df, {"晶圆": "晶圆品名"})]
+    sources += [candidates(df, {"生产料号": "品名", "产品型号": "规格"}) for df in forecast_dfs.values()]
+
+    # ✅ 所有候选按优先级顺序堆叠，空值/空串视为缺失，每个品名取第一个非空值：一次 groupby + 一次 join
+    stacked = pd.concat(sources, ignore_index=True).dropna(subset=["品名"])
+    for col in ["规格", "晶圆品名"]:
+        values = stacked[col].astype(str).str.strip()
+        stacked[col] = values.where(values.notna() & ~values.isin(["", "nan", "None"]))
+    attrs = stacked.groupby("品名", observed=True, sort=False)[["规格", "晶圆品名"]].first()
+
+    main_df = all_names[["品名"]].join(attrs, on="品名")
 
     return main_df[["晶圆品名", "规格", "品名"]]
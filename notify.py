@@ -0,0 +1,27 @@
+"""
+用户提示：在 Streamlit 会话中显示为 st.warning / st.error 等；
+没有 Streamlit 运行上下文时（命令行批处理、后台线程、子进程）写入日志 "forecast"。
+"""
+import logging
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+logger = logging.getLogger("forecast")
+
+# st 函数名 → 日志级别
+_LOG_LEVELS = {
+    "error": logging.ERROR,
+    "warning": logging.WARNING,
+    "info": logging.INFO,
+    "success": logging.INFO,
+    "write": logging.INFO,
+}
+
+
+def notify(level: str, message: str):
+    """level 为 st 的函数名（"warning"、"error"、"success" 等）"""
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        getattr(st, level)(message)
+    else:
+        logger.log(_LOG_LEVELS.get(level, logging.INFO), message)
@@ -0,0 +1,197 @@
+"""
+按文件内容寻址的解析缓存：
+键 = 文件字节哈希 + 读取参数（sheet / header 等），值 = 解析后的 DataFrame（优先 Parquet 列式存储）。
+缓存目录按总大小做 LRU 淘汰；不依赖 streamlit，可在子进程中使用。
+"""
+import hashlib
+import json
+import os
+import uuid
+from io import BytesIO
+
+import pandas as pd
+
+PARSE_CACHE_DIR = os.environ.get(
+    "FORECAST_PARSE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "parse")
+)
+PARSE_CACHE_MAX_BYTES = int(os.environ.get("FORECAST_PARSE_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+PARSE_CACHE_ENABLED = os.environ.get("FORECAST_PARSE_CACHE", "1") != "0"
+
+# 优先 Parquet；列名非字符串或列内类型混杂（Excel 常见）时退化为 pickle
+_FORMATS = (".parquet", ".pkl")
+
+
+def file_bytes(file) -> bytes:
+    """读取文件对象 / 路径 / bytes 的全部内容，并将文件指针复位"""
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    content = file.read()
+    file.seek(0)
+    return content
+
+
+def frame_version(df: pd.DataFrame) -> str:
+    """DataFrame 的内容哈希（含列名），用于判断两次运行的输入是否相同"""
+    hashed = pd.util.hash_pandas_object(df.astype(str), index=False)
+    digest = hashlib.sha256(hashed.values.tobytes())
+    digest.update("|".join(map(str, df.columns)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def write_frame(df: pd.DataFrame, base_path: str) -> str:
+    """
+    将 DataFrame 写入 base_path + 扩展名（优先 Parquet，失败时 pickle），先写临时文件再原子替换。
+    返回实际写入的路径；两种格式都失败时抛出最后的异常。
+    """
+    last_error = None
+    for ext in _FORMATS:
+        path = base_path + ext
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if ext == ".parquet":
+                df.to_parquet(tmp_path, index=True)
+            else:
+                df.to_pickle(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            last_error = e
+            _remove(tmp_path)
+            continue
+        # 同一条目只保留一种格式
+        for other in _FORMATS:
+            if other != ext:
+                _remove(base_path + other)
+        return path
+    raise last_error
+
+
+def read_frame(base_path: str):
+    """读取 write_frame 写入的 DataFrame，返回 (df, 路径)；不存在时返回 (None, None)"""
+    for ext in _FORMATS:
+        path = base_path + ext
+        if not os.path.exists(path):
+            continue
+        df = pd.read_parquet(path) if ext == ".parquet" else pd.read_pickle(path)
+        return df, path
+    return None, None
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ParseCache:
+    def __init__(self, root: str = PARSE_CACHE_DIR, max_bytes: int = PARSE_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(content: bytes, **params) -> str:
+        """内容哈希 + 读取参数哈希"""
+        digest = hashlib.sha256(content)
+        digest.update(json.dumps(params, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _base_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str):
+        """命中时返回新的 DataFrame 并刷新其访问时间，未命中返回 None"""
+        try:
+            df, path = read_frame(self._base_path(key))
+        except Exception:
+            # 损坏的缓存文件直接丢弃
+            for ext in _FORMATS:
+                _remove(self._base_path(key) + ext)
+            return None
+        if df is None:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return df
+
+    def put(self, key: str, df: pd.DataFrame):
+        """写入缓存，随后按大小淘汰最久未使用的条目；无法序列化时静默跳过"""
+        os.makedirs(os.path.join(self.root, key[:2]), exist_ok=True)
+        try:
+            write_frame(df, self._base_path(key))
+        except Exception:
+            return
+        self.evict()
+
+    def evict(self):
+        """缓存总大小超过 max_bytes 时，按访问时间从旧到新删除"""
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(_FORMATS):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def get_or_parse(self, content: bytes, parse, **params):
+        """
+        按内容 + 参数查缓存，未命中时调用 parse() 解析并写入缓存。
+        parse 返回的不是 DataFrame（如 None）时不缓存。
+        """
+        key = self.make_key(content, **params)
+        df = self.get(key)
+        if df is not None:
+            return df
+        df = parse()
+        if isinstance(df, pd.DataFrame):
+            self.put(key, df)
+        return df
+
+
+_default_cache = None
+
+
+def get_parse_cache():
+    """返回默认缓存实例；FORECAST_PARSE_CACHE=0 时返回 None（禁用缓存）"""
+    global _default_cache
+    if not PARSE_CACHE_ENABLED:
+        return None
+    if _default_cache is None:
+        _default_cache = ParseCache()
+    return _default_cache
+
+
+def read_excel_cached(file, **read_kwargs) -> pd.DataFrame:
+    """
+    带内容寻址缓存的 pd.read_excel：字节相同且参数相同时直接读取缓存，不再解析 Excel。
+    """
+    content = file_bytes(file)
+    cache = get_parse_cache()
+    if cache is None:
+        return pd.read_excel(BytesIO(content), **read_kwargs)
+    return cache.get_or_parse(
+        content,
+        lambda: pd.read_excel(BytesIO(content), **read_kwargs),
+        kind="read_excel",
+        **read_kwargs
+    )
@@ -1,196 +1,457 @@
+import numpy as np
 import pandas as pd
-import streamlit as st
 from openpyxl import load_workbook
 from openpyxl.styles import Font
 from openpyxl.utils.dataframe import dataframe_to_rows
 from io import BytesIO
 import re
+import threading
 from datetime import datetime
-from openpyxl.utils import get_column_letter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def extract_file_date(file_name: str) -> str:
+    match = re.search(r"(\d{8})", file_name)
+    return match.group(1) if match else "00000000"
+
+def detect_header_row(df: pd.DataFrame) -> int:
+    for i, row in df.iterrows():
+        if any(isinstance(cell, str) and "产品型号" in str(cell) for cell in row):
+            return i
+    return 0
+
+def standardize_column_name(forecast_col: str, file_date: str) -> str:
+    """
+    将原始预测列名（如“6月预测”）标准化为“yyyy-mm的预测（yyyy-mm生成）”，处理跨年。
+    """
+    month_match = re.match(r"^(\d{1,2})月预测$", forecast_col.strip())
+    alt_match = re.match(r"^(\d{1,2})月预测\d*$", forecast_col.strip())
+    if month_match or alt_match:
+        forecast_month = int((month_match or alt_match).group(1))
+    else:
+        return f"{file_date}-{forecast_col.strip()}"  # fallback: 原样列名
+
+    file_year = int(file_date[:4])
+    file_month = int(file_date[4:6])
+
+    # ✅ 处理跨年：如果预测月份小于生成月份，则年份加一
+    if forecast_month < file_month:
+        forecast_year = file_year + 1
+    else:
+        forecast_year = file_year
+
+    forecast_month_str = str(forecast_month).zfill(2)
+    file_month_str = str(file_month).zfill(2)
+    return f"{forecast_year}-{forecast_month_str}的预测（{file_year}-{file_month_str}生成）"
+
+
+# 后台生成 Excel 的线程池（模块级，Streamlit 重跑脚本时复用）
+_EXCEL_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="excel-export")
+
+
+# 各数据源中的品名列
+FIELD_MAPPINGS = {
+    "forecast": {"品名": "生产料号"},
+    "order": {"品名": "品名"},
+    "sales": {"品名": "品名"}
+}
+
+
+def apply_mapping_to_all_forecasts(forecast_dfs: dict[str, pd.DataFrame], resolver, keys: dict = None) -> dict[str, pd.DataFrame]:
+    """替换预测中品名（第二列）；keys 为 {文件名: 已规范化的品名键}"""
+    keys = keys or {}
+    mapped_dfs = {}
+    for name, df in forecast_dfs.items():
+        if df.shape[1] < 2:
+            continue
+        second_col = df.columns[1]
+        try:
+            df_mapped, _ = resolver.apply(df, second_col, keys=keys.get(name))
+            mapped_dfs[name] = df_mapped
+        except KeyError as e:
+            raise ValueError(f"❌ `{name}` 缺失列: {e}. 实际列: {df.columns.tolist()}") from e
+    return mapped_dfs
+
+
+def iter_monthly_expanded(main_df: pd.DataFrame, facts: pd.DataFrame = None):
+    """
+    按月份逐块生成“月度展开”：每块为一个月份下主表所有品名的行，
+    列为 识别列 + 月份 + 各生成时间的预测 + 订单 + 出货（各块列相同）。
+    由预测事实长表按下标写入，不逐行构建，也不一次性物化整张长表。
+    """
+    from fact_table import build_forecast_facts
+
+    if facts is None:
+        facts = build_forecast_facts(main_df)
+
+    name_fields = ["晶圆品名", "规格", "品名"]
+    id_cols = [col for col in main_df.columns if col in name_fields]
+
+    # 按 (月份, 生成时间) 排序；预测列头按首次出现的先后排列（在 Period 序数上计算，避免装箱）
+    month_ord = facts["预测月份"].array.asi8
+    gen_ord = facts["生成月份"].array.asi8
+    pair_keys = np.sort(pd.unique((month_ord << 32) | gen_ord))
+    month_vals = pd.unique(pair_keys >> 32)
+    gen_vals = pd.unique(pair_keys & 0xFFFFFFFF)
+    months = pd.PeriodIndex.from_ordinals(month_vals, freq="M").astype(str)
+    gens = pd.PeriodIndex.from_ordinals(gen_vals, freq="M").astype(str)
+    forecast_headers = [f"预测（{gen}生成）" for gen in gens]
+    n_rows = len(main_df)
+
+    # 事实表按月份分段（稳定排序），每个月只处理自己那一段
+    month_idx = np.searchsorted(month_vals, month_ord)
+    order = np.argsort(month_idx, kind="stable")
+    bounds = np.searchsorted(month_idx[order], np.arange(len(months) + 1))
+    gen_idx = pd.Index(gen_vals).get_indexer(gen_ord)[order]
+    row_idx = facts["行号"].to_numpy()[order]
+    values = {col: facts[col].to_numpy(dtype=np.float64)[order] for col in ["预测值", "订单量", "出货量"]}
+    id_values = {col: main_df[col].to_numpy() for col in id_cols}
+
+    def by_row(kind, part):
+        column = np.full(n_rows, np.nan)
+        column[row_idx[part]] = values[kind][part]
+        column = pd.Series(column)
+        # 主计划缺少该月订单/出货列时留空
+        return column.astype(object).where(column.notna(), "") if column.isna().any() else column
+
+    for i, month in enumerate(months):
+        part = slice(bounds[i], bounds[i + 1])
+
+        # 预测：品名 × 生成时间，无该生成时间的位置为空
+        forecast_block = np.full((n_rows, len(gens)), np.nan)
+        forecast_block[row_idx[part], gen_idx[part]] = values["预测值"][part]
+
+        chunk = pd.DataFrame(id_values)
+        chunk["月份"] = month
+        chunk = pd.concat([chunk, pd.DataFrame(forecast_block, columns=forecast_headers)], axis=1)
+        chunk["订单"] = by_row("订单量", part)
+        chunk["出货"] = by_row("出货量", part)
+        yield chunk
+
+
+def build_monthly_expanded(main_df: pd.DataFrame, facts: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    “月度展开”整表：每个 (月份, 品名) 一行，行按月份在外、主表行序在内。
+    """
+    chunks = list(iter_monthly_expanded(main_df, facts))
+    if chunks:
+        return pd.concat(chunks, ignore_index=True)
+    id_cols = [col for col in main_df.columns if col in ["晶圆品名", "规格", "品名"]]
+    return pd.DataFrame(columns=[*id_cols, "月份", "订单", "出货"])
+
 
 class PivotProcessor:
-    def process(self, forecast_files, order_file, sales_file, mapping_file):
-        from mapping_utils import apply_mapping_and_merge, apply_extended_substitute_mapping, split_mapping_data
-        from info_extract import extract_all_year_months, fill_order_data, fill_sales_data, highlight_by_detecting_column_headers
-        from name_utils import build_main_df
-        from forecast_utils import load_forecast_files, reorder_columns_by_month, merge_monthly_group_headers, merge_and_color_monthly_group_headers, drop_order_shipping_without_forecast
-        
+    def __init__(self, load_workers: int = 1, snapshot_store=None):
+        """
+        load_workers: 并行解析预测文件的进程数；None 表示按 CPU 核数（最多 FORECAST_LOAD_MAX_WORKERS），1 表示顺序读取。
+        snapshot_store: ForecastSnapshotStore；提供时新上传的原始预测写入快照库，并与库中历史预测（按当前映射替换品名）合并生成主计划。
+        """
+        self.load_workers = load_workers
+        self.snapshot_store = snapshot_store
+        # 上次计算的输入与未过滤的主计划，供 update_mapping 增量更新
+        self._state = None
+        # 最近一次主计划对应的预测事实长表，供各 sheet 共用
+        self._facts = None
+        # 处理器可放入结果缓存供多个会话共用，增量更新需串行
+        self._lock = threading.Lock()
 
+    def process(self, forecast_files, order_file, sales_file, mapping_file, excel: bool = True):
+        """
+        返回 (main_df, excel_output)；excel=False 时不生成 Excel（excel_output 为 None），
+        可随后用 build_excel_async 在后台生成。
+        """
+        from forecast_utils import load_forecast_files
 
         # ✅ 加载原始预测文件
-        forecast_dfs = load_forecast_files(forecast_files)
-        mapping_semi, mapping_new, mapping_sub = split_mapping_data(mapping_file)
-        main_df = build_main_df(forecast_dfs, order_file, sales_file, mapping_new, mapping_sub)
-
-        FIELD_MAPPINGS = {
-            "forecast": {"品名": "生产料号"},
-            "order": {"品名": "品名"},
-            "sales": {"品名": "品名"}
-        }
+        forecast_dfs = load_forecast_files(forecast_files, workers=self.load_workers)
+
+        main_df = self.compute(forecast_dfs, order_file, sales_file, mapping_file)
+        return main_df, self.build_excel(main_df) if excel else None
+
+    def compute(self, forecast_dfs: dict[str, pd.DataFrame], order_file, sales_file, mapping_file) -> pd.DataFrame:
+        """
+        由已读取的预测、订单、出货和新旧料号表计算主计划（不生成 Excel）。
+        """
+        from mapping_utils import get_name_resolver
+        from info_extract import extract_all_year_months
+        from name_utils import normalize_part_key
 
-        # ✅ 替换预测中品名
-        def apply_mapping_to_all_forecasts(forecast_dfs: dict[str, pd.DataFrame], mapping_new, mapping_sub) -> dict[str, pd.DataFrame]:
-            from mapping_utils import apply_mapping_and_merge, apply_extended_substitute_mapping
-            mapped_dfs = {}
+        # ✅ 按新旧料号表编译一次品名解析器，预测/订单/出货/主表共用
+        resolver = get_name_resolver(mapping_file)
+
+        # ✅ 每份输入只做一次品名键规范化（全角/半角、空白、换行）
+        forecast_keys = {name: normalize_part_key(df[df.columns[1]]) for name, df in forecast_dfs.items() if df.shape[1] >= 2}
+        order_keys = normalize_part_key(order_file[FIELD_MAPPINGS["order"]["品名"]])
+        sales_keys = normalize_part_key(sales_file[FIELD_MAPPINGS["sales"]["品名"]])
+
+        mapped_forecast_dfs = apply_mapping_to_all_forecasts(forecast_dfs, resolver, forecast_keys)
+
+        # ✅ 快照库：保存新上传的原始预测（未替换品名），合并库中历史预测时按当前映射重新替换
+        if self.snapshot_store is not None:
             for name, df in forecast_dfs.items():
-                if df.shape[1] < 2:
-                    continue
-                second_col = df.columns[1]
-                field_mapping = {"品名": second_col}
-                try:
-                    df_mapped, _ = apply_mapping_and_merge(df.copy(), mapping_new, field_mapping)
-                    df_mapped, _ = apply_extended_substitute_mapping(df_mapped, mapping_sub, field_mapping)
-                    mapped_dfs[name] = df_mapped
-                except KeyError as e:
-                    raise ValueError(f"❌ `{name}` 缺失列: {e}. 实际列: {df.columns.tolist()}") from e
-            return mapped_dfs
-
-        forecast_dfs = apply_mapping_to_all_forecasts(forecast_dfs, mapping_new, mapping_sub)
-        order_file, _ = apply_mapping_and_merge(order_file, mapping_new, FIELD_MAPPINGS["order"])
-        order_file, _ = apply_extended_substitute_mapping(order_file, mapping_sub, FIELD_MAPPINGS["order"])
-        sales_file, _ = apply_mapping_and_merge(sales_file, mapping_new, FIELD_MAPPINGS["sales"])
-        sales_file, _ = apply_extended_substitute_mapping(sales_file, mapping_sub, FIELD_MAPPINGS["sales"])
+                self.snapshot_store.save(name, df)
+            history_dfs = {
+                name: df for name, df in self.snapshot_store.load(exclude=forecast_dfs.keys()).items() if df.shape[1] >= 2
+            }
+            history_keys = {name: normalize_part_key(df[df.columns[1]]) for name, df in history_dfs.items()}
+            # 历史与新上传的预测按生成日期排列，与一次性上传全部文件时的列顺序一致
+            order = sorted({**history_dfs, **forecast_dfs}, key=lambda name: (extract_file_date(name), name))
+            merged_keys = {**history_keys, **forecast_keys}
+            merged_mapped = {**apply_mapping_to_all_forecasts(history_dfs, resolver, history_keys), **mapped_forecast_dfs}
+            merged_dfs = {**history_dfs, **forecast_dfs}
+            forecast_keys = {name: merged_keys[name] for name in order if name in merged_keys}
+            mapped_forecast_dfs = {name: merged_mapped[name] for name in order if name in merged_mapped}
+            forecast_dfs = {name: merged_dfs[name] for name in order}
+
+        order_mapped, _ = resolver.apply(order_file, FIELD_MAPPINGS["order"]["品名"], keys=order_keys)
+        sales_mapped, _ = resolver.apply(sales_file, FIELD_MAPPINGS["sales"]["品名"], keys=sales_keys)
 
         # ✅ 提取所有月份（订单/出货用）
-        all_months = extract_all_year_months(forecast_dfs, order_file, sales_file)
-        for ym in all_months:
-            main_df[f"{ym}-订单"] = 0
-            main_df[f"{ym}-出货"] = 0
-
-        # ✅ 填充所有预测数据（独立列）
-        def extract_file_date(file_name: str) -> str:
-            match = re.search(r"(\d{8})", file_name)
-            return match.group(1) if match else "00000000"
-
-        def detect_header_row(df: pd.DataFrame) -> int:
-            for i, row in df.iterrows():
-                if any(isinstance(cell, str) and "产品型号" in str(cell) for cell in row):
-                    return i
-            return 0
-
-        def standardize_column_name(forecast_col: str, file_date: str) -> str:
-            """
-            将原始预测列名（如“6月预测”）标准化为“yyyy-mm的预测（yyyy-mm生成）”，处理跨年。
-            """
-            month_match = re.match(r"^(\d{1,2})月预测$", forecast_col.strip())
-            alt_match = re.match(r"^(\d{1,2})月预测\d*$", forecast_col.strip())
-            if month_match or alt_match:
-                forecast_month = int((month_match or alt_match).group(1))
-            else:
-                return f"{file_date}-{forecast_col.strip()}"  # fallback: 原样列名
-        
-            file_year = int(file_date[:4])
-            file_month = int(file_date[4:6])
-            
-            # ✅ 处理跨年：如果预测月份小于生成月份，则年份加一
-            if forecast_month < file_month:
-                forecast_year = file_year + 1
-            else:
-                forecast_year = file_year
-        
-            forecast_month_str = str(forecast_month).zfill(2)
-            file_month_str = str(file_month).zfill(2)
-            return f"{forecast_year}-{forecast_month_str}的预测（{file_year}-{file_month_str}生成）"
-
-
-        def fill_forecast_data(main_df: pd.DataFrame, forecast_dfs: dict[str, pd.DataFrame]) -> pd.DataFrame:
-            for file_name, df in forecast_dfs.items():
-                file_date = extract_file_date(file_name)
-                name_col = "生产料号" if "生产料号" in df.columns else (df.columns[1] if df.shape[1] >= 2 else None)
-                if name_col is None:
-                    continue
-                df["品名"] = df[name_col].astype(str).str.strip()
-                for col in df.columns:
-                    if isinstance(col, str) and "预测" in col:
-                        new_col = standardize_column_name(col, file_date)
-                        if new_col not in main_df.columns:
-                            main_df[new_col] = 0
-                        forecast_series = df[["品名", col]].dropna().groupby("品名")[col].sum(min_count=1)
-                        main_df[new_col] = main_df["品名"].map(forecast_series).fillna(0)
-            return main_df
-
-        main_df = fill_forecast_data(main_df, forecast_dfs)
-        main_df = fill_order_data(main_df, order_file, all_months)
-        main_df = fill_sales_data(main_df, sales_file, all_months)
-
-        main_df = reorder_columns_by_month(main_df)
-        main_df = drop_order_shipping_without_forecast(main_df)
+        all_months = extract_all_year_months(mapped_forecast_dfs, order_mapped, sales_mapped)
+
+        plan = self._assemble(mapped_forecast_dfs, order_mapped, sales_mapped, resolver, all_months)
+
+        # ✅ 缓存原始输入（含规范化后的品名键）与未过滤的主计划
+        keys = {f"forecast:{name}": key for name, key in forecast_keys.items()}
+        keys["order"] = order_keys
+        keys["sales"] = sales_keys
+        self._state = {
+            "forecast_dfs": {name: df for name, df in forecast_dfs.items() if df.shape[1] >= 2},
+            "order": order_file,
+            "sales": sales_file,
+            "keys": keys,
+            "mapping_df": mapping_file,
+            "all_months": all_months,
+            "plan": plan,
+        }
+
+        return self._finalize(plan)
+
+    def update_mapping(self, mapping_file, excel: bool = True):
+        """
+        新旧料号表更新后的增量计算：只对 diff 涉及的品名重新解析和聚合，其余行沿用上次结果。
+        返回 (main_df, excel_output)；excel=False 时 excel_output 为 None。
+        """
+        if self._state is None:
+            raise ValueError("❌ 尚未生成过主计划，无法增量更新新旧料号")
+        with self._lock:
+            main_df = self._update_mapping(mapping_file)
+        return main_df, self.build_excel(main_df) if excel else None
+
+    def _update_mapping(self, mapping_file) -> pd.DataFrame:
+        from mapping_utils import get_name_resolver, diff_mapping_data, mapping_diff_names
+
+        state = self._state
+
+        diff = diff_mapping_data(state["mapping_df"], mapping_file)
+        touched = mapping_diff_names(diff)
+        if touched:
+            old_resolver = get_name_resolver(state["mapping_df"])
+            new_resolver = get_name_resolver(mapping_file)
+
+            # 原始品名（去重、保持出现顺序）在新旧两版映射下的最终品名
+            raw_names = pd.concat(list(state["keys"].values()), ignore_index=True).drop_duplicates()
+            old_final = old_resolver.resolve(raw_names)
+            new_final = new_resolver.resolve(raw_names)
+            changed = old_final != new_final
+            touched_series = pd.Series(sorted(touched), dtype=object)
+            affected = (
+                set(old_final[changed]) | set(new_final[changed]) | touched
+                | set(old_resolver.resolve(touched_series)) | set(new_resolver.resolve(touched_series))
+            )
+
+            # 只取最终品名受影响的原始行重新计算
+            affected_raw = set(raw_names[new_final.isin(affected)])
+            keys = state["keys"]
+            sub_forecasts = {
+                name: df[keys[f"forecast:{name}"].isin(affected_raw)]
+                for name, df in state["forecast_dfs"].items()
+            }
+            sub_order = state["order"][keys["order"].isin(affected_raw)]
+            sub_sales = state["sales"][keys["sales"].isin(affected_raw)]
+
+            partial = self._assemble(
+                apply_mapping_to_all_forecasts(
+                    sub_forecasts, new_resolver,
+                    {name: keys[f"forecast:{name}"][df.index] for name, df in sub_forecasts.items()}
+                ),
+                new_resolver.apply(sub_order, FIELD_MAPPINGS["order"]["品名"], keys=keys["order"][sub_order.index])[0],
+                new_resolver.apply(sub_sales, FIELD_MAPPINGS["sales"]["品名"], keys=keys["sales"][sub_sales.index])[0],
+                new_resolver,
+                state["all_months"],
+            )
+
+            plan = state["plan"]
+            plan = plan[~plan["品名"].isin(affected)]
+            plan = pd.concat([plan, partial.reindex(columns=plan.columns, fill_value=0)], ignore_index=True)
+
+            # 行顺序与全量计算一致：按最终品名首次出现的顺序
+            name_rank = pd.Series(range(len(new_final)), index=new_final.values)
+            name_rank = name_rank[~name_rank.index.duplicated()]
+            plan = plan.iloc[plan["品名"].map(name_rank).argsort(kind="stable")].reset_index(drop=True)
+
+            state["plan"] = plan
+
+        state["mapping_df"] = mapping_file
+        return self._finalize(state["plan"])
+
+    def nbytes(self) -> int:
+        """缓存的输入与主计划占用的内存（供结果缓存计入预算）"""
+        from result_cache import estimate_nbytes
+
+        return estimate_nbytes(self._state) + estimate_nbytes(self._facts)
+
+    def _assemble(self, forecast_dfs: dict[str, pd.DataFrame], order_file, sales_file, resolver, all_months) -> pd.DataFrame:
+        """
+        由已替换品名的各数据源组装未过滤的主计划：
+        识别列（晶圆品名/规格/品名）+ 一整块预分配的数值矩阵（品名 × 月份/类型/生成时间），各填充阶段按下标数组写入。
+        """
+        from info_extract import aggregate_order_data, aggregate_sales_data
+        from name_utils import build_main_df, PartKeyDictionary, normalize_part_key
+
+        # ✅ 所有数据源的品名编码到同一个字典，之后的合并/分组/取值都基于整数码
+        name_cols = {name: df.columns[1] for name, df in forecast_dfs.items()}
+        part_keys = PartKeyDictionary(
+            *[df[name_cols[name]] for name, df in forecast_dfs.items()],
+            order_file[FIELD_MAPPINGS["order"]["品名"]],
+            sales_file[FIELD_MAPPINGS["sales"]["品名"]],
+        )
+        forecast_dfs = {name: df.assign(**{name_cols[name]: part_keys.encode(df[name_cols[name]])}) for name, df in forecast_dfs.items()}
+        order_file = order_file.assign(**{FIELD_MAPPINGS["order"]["品名"]: part_keys.encode(order_file[FIELD_MAPPINGS["order"]["品名"]])})
+        sales_file = sales_file.assign(**{FIELD_MAPPINGS["sales"]["品名"]: part_keys.encode(sales_file[FIELD_MAPPINGS["sales"]["品名"]])})
+
+        main_df = build_main_df(forecast_dfs, order_file, sales_file, resolver.mapping_new, resolver.mapping_sub, part_keys=part_keys)
+
+        # ✅ 预测列来源：同一标准化列名由多个 (文件, 列) 提供时以最后一个为准；列顺序按首次出现
+        sources = {}
+        for file_name, df in forecast_dfs.items():
+            file_date = extract_file_date(file_name)
+            for col in df.columns:
+                if isinstance(col, str) and "预测" in col:
+                    sources[standardize_column_name(col, file_date)] = (file_name, col)
+
+        # ✅ 列布局：每月“订单/出货”在前，预测列在后；数值部分预分配为一个二维矩阵
+        columns = [f"{ym}-{kind}" for ym in all_months for kind in ("订单", "出货")]
+        columns = pd.Index(columns + [col for col in sources if col not in set(columns)])
+        block = np.zeros((len(main_df), len(columns)))
+
+        # 品名整数码 → 主表行号
+        main_codes = main_df["品名"].cat.codes.to_numpy()
+        row_of_code = np.full(len(part_keys.dtype.categories), -1)
+        row_of_code[main_codes[main_codes >= 0]] = np.flatnonzero(main_codes >= 0)
+
+        def scatter(codes, col_names, values):
+            """按 (品名码, 列名) 写入矩阵；品名或列不在主计划中的值忽略"""
+            codes = np.asarray(codes)
+            rows = np.where(codes >= 0, row_of_code[codes], -1)
+            cols = columns.get_indexer(col_names)
+            keep = (rows >= 0) & (cols >= 0)
+            block[rows[keep], cols[keep]] = np.asarray(values)[keep]
+
+        # ✅ 填充所有预测数据（独立列）：各文件展开为长表后一次 groupby
+        long_parts = []
+        for file_name, df in forecast_dfs.items():
+            name_col = "生产料号" if "生产料号" in df.columns else (df.columns[1] if df.shape[1] >= 2 else None)
+            if name_col is None:
+                continue
+            value_cols = {col: new_col for new_col, (src, col) in sources.items() if src == file_name}
+            if not value_cols:
+                continue
+            names = df[name_col] if isinstance(df[name_col].dtype, pd.CategoricalDtype) else part_keys.encode(normalize_part_key(df[name_col]))
+            long_df = (
+                df[list(value_cols)]
+                .assign(品名=names.cat.codes)
+                .melt(id_vars="品名", var_name="列名", value_name="值")
+            )
+            long_df["列名"] = long_df["列名"].map(value_cols)
+            long_parts.append(long_df)
+        if long_parts:
+            long_df = pd.concat(long_parts, ignore_index=True)
+            long_df = long_df[(long_df["品名"] >= 0) & long_df["值"].notna()]
+            forecast_sum = long_df.groupby(["品名", "列名"], sort=False)["值"].sum(min_count=1)
+            scatter(
+                forecast_sum.index.get_level_values("品名"),
+                forecast_sum.index.get_level_values("列名"),
+                pd.to_numeric(forecast_sum, errors="coerce").fillna(0),
+            )
+
+        # ✅ 订单、出货：按 (品名, 年月) 汇总后写入对应月份的列
+        for aggregated, kind in ((aggregate_order_data(order_file), "订单"), (aggregate_sales_data(sales_file), "出货")):
+            if aggregated.empty:
+                continue
+            scatter(
+                aggregated.index.get_level_values("品名").codes,
+                aggregated.index.get_level_values("年月") + f"-{kind}",
+                aggregated,
+            )
+
+        return pd.concat([main_df, pd.DataFrame(block, index=main_df.index, columns=columns)], axis=1)
+
+    def _finalize(self, main_df: pd.DataFrame) -> pd.DataFrame:
+        """列按月份排序、删除无预测月份的订单/出货列、删除全为 0 的行"""
+        from forecast_utils import reorder_columns_by_month, drop_order_shipping_without_forecast
+
+        # 品名从共享字典的 Categorical 还原为字符串
+        if isinstance(main_df["品名"].dtype, pd.CategoricalDtype):
+            main_df = main_df.assign(品名=main_df["品名"].astype(main_df["品名"].cat.categories.dtype))
+
+        # ✅ 最终列只由列名决定：在空表上排序、删列，再连同非零行一次取出
+        final_cols = drop_order_shipping_without_forecast(reorder_columns_by_month(main_df.iloc[:0])).columns
+        col_positions = main_df.columns.get_indexer(final_cols)
 
         # 删除所有数值列（除前3列）都为 0 或空的行
-        value_cols = main_df.columns[3:]  # 假设前三列为识别字段
-        main_df = main_df[~(main_df[value_cols].fillna(0) == 0).all(axis=1)]
-
-        # ✅ 写入 Excel
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine="openpyxl") as writer:
-            main_df.to_excel(writer, index=False, sheet_name="预测分析", startrow=1)
-            ws = writer.sheets["预测分析"]
-            merge_monthly_group_headers(ws, main_df)
-            merge_and_color_monthly_group_headers(ws, main_df)
-
-            for col_idx, column_cells in enumerate(ws.columns, 1):
-                max_length = 0
-                for cell in column_cells:
-                    try:
-                        if cell.value:
-                            max_length = max(max_length, len(str(cell.value)))
-                    except:
-                        pass
-                ws.column_dimensions[get_column_letter(col_idx)].width = max_length + 10
-
-
-            # ✅ 构建“月度展开”sheet（预测集中 + 列宽调整）
-            monthly_rows = []
-            name_fields = ["晶圆品名", "规格", "品名"]
-            id_cols = [col for col in main_df.columns if col in name_fields]
-
-            # 收集所有预测列（提取年月、生成时间）
-            pattern_f = re.compile(r"(\d{4}-\d{2})的预测（(\d{4}-\d{2})生成）")
-            forecast_columns = []
-            for col in main_df.columns:
-                match = pattern_f.match(col)
-                if match:
-                    forecast_columns.append((match.group(1), match.group(2), col))  # (月份, 生成时间, 列名)
-
-            # 按月份、生成时间排序
-            forecast_columns = sorted(forecast_columns)
-
-            # 按月份收集所有订单、出货列
-            months = sorted(set(m for m, _, _ in forecast_columns))
-            for m in months:
-                forecast_this_month = [(gen, col) for fm, gen, col in forecast_columns if fm == m]
-                order_col = f"{m}-订单"
-                ship_col = f"{m}-出货"
-
-                for _, row in main_df.iterrows():
-                    row_dict = {col: row.get(col, "") for col in id_cols}
-                    row_dict["月份"] = m
-
-                    # 添加所有预测列（按生成时间）
-                    for gen, col in forecast_this_month:
-                        row_dict[f"预测（{gen}生成）"] = row.get(col, "")
-
-                    row_dict["订单"] = row.get(order_col, "")
-                    row_dict["出货"] = row.get(ship_col, "")
-                    monthly_rows.append(row_dict)
-
-            # 转换为 DataFrame
-            df_wide = pd.DataFrame(monthly_rows)
-
-            # 列顺序整理
-            forecast_headers = [col for col in df_wide.columns if "预测（" in col]
-            final_order = [*id_cols, "月份"] + forecast_headers + ["订单", "出货"]
-            df_wide = df_wide[final_order]
-
-            # 写入 Excel
-            df_wide.to_excel(writer, sheet_name="月度展开", index=False)
-            ws = writer.sheets["月度展开"]
-
-            # ✅ 自动列宽
-            for col_idx, column_cells in enumerate(ws.columns, 1):
-                max_len = max((len(str(cell.value)) for cell in column_cells if cell.value), default=0)
-                col_letter = get_column_letter(col_idx)
-                ws.column_dimensions[col_letter].width = max_len + 10
-
-        output.seek(0)
-        return main_df, output
+        values = main_df.iloc[:, col_positions[3:]].to_numpy()  # 假设前三列为识别字段
+        keep_rows = ((values != 0) & ~pd.isna(values)).any(axis=1)
+
+        return main_df.iloc[keep_rows, col_positions]
+
+    def forecast_facts(self, main_df: pd.DataFrame) -> pd.DataFrame:
+        """主计划的预测事实长表；同一个 main_df 只构建一次"""
+        from fact_table import build_forecast_facts
+
+        if self._facts is None or self._facts[0] is not main_df:
+            self._facts = (main_df, build_forecast_facts(main_df))
+        return self._facts[1]
+
+    def columnar_tables(self, main_df: pd.DataFrame) -> dict:
+        """可列式导出的表：{表名: 构建函数}；调用时才构建（月度展开只在需要时物化）"""
+        return {
+            "主计划": lambda: main_df,
+            "月度展开": lambda: build_monthly_expanded(main_df, self.forecast_facts(main_df)),
+            "预测事实表": lambda: self.forecast_facts(main_df),
+        }
+
+    def build_columnar(self, main_df: pd.DataFrame, formats=("parquet",), as_zip: bool = False):
+        """
+        将主计划、月度展开、预测事实表直接导出为列式 / 文本格式（parquet、arrow、csv），不经过 openpyxl。
+        返回 {文件名: 字节}；as_zip=True 时返回打包后的 ZIP 字节。
+        """
+        from columnar_export import export_tables, zip_files
+
+        files = export_tables({name: build() for name, build in self.columnar_tables(main_df).items()}, formats)
+        return zip_files(files) if as_zip else files
+
+    def build_excel_async(self, main_df: pd.DataFrame, highlight: bool = False) -> Future:
+        """在后台线程生成 Excel，立即返回 Future（结果为 BytesIO）"""
+        return _EXCEL_EXECUTOR.submit(self.build_excel, main_df, highlight)
+
+    def build_excel(self, main_df: pd.DataFrame, highlight: bool = False) -> BytesIO:
+        """
+        将主计划流式写入 Excel（预测分析 + 月度展开），返回 BytesIO。
+        highlight=True 时在“预测分析”中以条件格式标红“预测>0 且 订单为空或 0”的预测/订单列对（默认不标）。
+        """
+        from excel_export import export_workbook, column_widths, width_sample, EXCEL_WIDTH_SAMPLE_ROWS
+
+        facts = self.forecast_facts(main_df)
+
+        # ✅ “月度展开”按月份逐块生成并写入，超过 Excel 行数上限时自动续表；
+        #    列宽需在写行之前确定，由抽样品名的展开结果估算
+        n_months = max(1, facts["预测月份"].nunique())
+        width_rows = build_monthly_expanded(width_sample(main_df, EXCEL_WIDTH_SAMPLE_ROWS // n_months))
+        monthly_widths = column_widths(width_rows, [list(width_rows.columns)], sample_rows=None)
+
+        # ✅ 写入 Excel：预测分析带两行月份表头，可选以条件格式标出“有预测无订单”
+        return export_workbook([
+            ("预测分析", main_df, {"month_header": True, "highlight": highlight}),
+            ("月度展开", iter_monthly_expanded(main_df, facts), {"columns": list(width_rows.columns), "widths": monthly_widths, "styled_header": True}),
+        ])
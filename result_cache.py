@@ -0,0 +1,118 @@
+"""
+服务器级结果缓存：按输入内容哈希保存主计划、列式导出、后台 Excel 任务以及供增量更新的处理器，
+同一进程内的所有会话共享；按内存预算以 LRU 顺序淘汰，加锁保证并发会话安全。
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from io import BytesIO
+
+import pandas as pd
+
+# 缓存占用的内存上限（MB）；0 表示禁用
+RESULT_CACHE_MAX_MB = float(os.environ.get("FORECAST_RESULT_CACHE_MB", 1024))
+
+
+def estimate_nbytes(value) -> int:
+    """估算缓存值占用的内存：DataFrame / Series、bytes、BytesIO、Future 的结果、带 nbytes() 的对象及其容器"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, BytesIO):
+        return value.getbuffer().nbytes
+    if isinstance(value, Future):
+        # 未完成的任务按 0 计，完成时由回调更新该条目的大小
+        if not value.done() or value.cancelled() or value.exception() is not None:
+            return 0
+        return estimate_nbytes(value.result())
+    if callable(getattr(value, "nbytes", None)):
+        return int(value.nbytes())
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    return 0
+
+
+def _growing_parts(value) -> list:
+    """缓存值中之后还会变大的部分（Future、LazyExports 等带 add_done_callback 的对象）"""
+    parts = value.values() if isinstance(value, dict) else value if isinstance(value, (list, tuple)) else [value]
+    return [part for part in parts if callable(getattr(part, "add_done_callback", None))]
+
+
+class ResultCache:
+    """
+    每个条目的大小在写入时估算一次并维护总量；条目中的后台任务完成（或按需导出产生新文件）时，
+    通过回调只重新估算该条目。读写都不再扫描其他条目。
+    """
+    def __init__(self, max_mb: float = RESULT_CACHE_MAX_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()  # {键: (值, 大小)}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """命中时返回缓存值并标记为最近使用，否则返回 None"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        size = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._entries[key][1]
+            self._entries[key] = (value, size)
+            self._entries.move_to_end(key)
+            self._total += size
+            self._evict()
+        # 在锁外注册：已完成的 Future 会立即调用回调
+        for part in _growing_parts(value):
+            part.add_done_callback(lambda _, key=key, value=value: self._resize(key, value))
+
+    def _resize(self, key, value):
+        """条目内容变大后重新估算它的大小；条目已被淘汰或替换时忽略"""
+        size = estimate_nbytes(value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return
+            self._total += size - entry[1]
+            self._entries[key] = (value, size)
+            self._evict()
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._total
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+
+    def _evict(self):
+        """超出预算时从最久未使用的条目开始淘汰；单个条目超出预算时也不保留"""
+        while self._entries and self._total > self.max_bytes:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._total -= size
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """进程内共享的结果缓存；FORECAST_RESULT_CACHE_MB=0 时返回 None（禁用缓存）"""
+    global _default_cache
+    if RESULT_CACHE_MAX_MB <= 0:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
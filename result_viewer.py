@@ -0,0 +1,105 @@
+"""
+主计划分页查看器：完整结果只保存在服务器端，浏览器每次只收到当前一页。
+按 晶圆品名 / 规格 / 品名 筛选、按月份范围选列，均基于预先计算的索引（整数码、月份→列号），
+不在每次交互时扫描整张表。
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from forecast_utils import month_column_groups
+
+VIEWER_FILTER_COLUMNS = ["晶圆品名", "规格", "品名"]
+VIEWER_PAGE_SIZES = [50, 100, 200, 500]
+
+
+class PlanIndex:
+    """主计划的查询索引：每个筛选列的整数码与可选值、月份到列位置的映射"""
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.codes = {}
+        self.options = {}
+        for col in VIEWER_FILTER_COLUMNS:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col].astype(object).where(df[col].notna(), ""), sort=True)
+            self.codes[col] = codes
+            self.options[col] = pd.Index(uniques.astype(str))
+
+        groups = month_column_groups(df.columns)
+        self.months = sorted(groups)
+        # 月份 → 列位置（从 0 开始）；不带月份的列（品名等）始终显示
+        self.month_positions = {month: [idx - 1 for idx in col_indexes] for month, col_indexes in groups.items()}
+        month_cols = {pos for positions in self.month_positions.values() for pos in positions}
+        self.id_positions = [pos for pos in range(df.shape[1]) if pos not in month_cols]
+
+    def nbytes(self) -> int:
+        """索引本身占用的内存（不含 df，df 即主计划，已单独计入结果缓存）"""
+        return sum(codes.nbytes for codes in self.codes.values()) + sum(
+            options.memory_usage(deep=True) for options in self.options.values()
+        )
+
+    def rows(self, selections: dict = None, name_keyword: str = "") -> np.ndarray:
+        """
+        满足筛选条件的行位置：selections 为 {列: [值, ...]}（空列表表示不筛选），
+        name_keyword 为品名包含的关键字（不区分大小写）。只在去重后的可选值上匹配，再按整数码取行。
+        """
+        mask = np.ones(len(self.df), dtype=bool)
+        for col, values in (selections or {}).items():
+            if values and col in self.codes:
+                wanted = self.options[col].get_indexer(values)
+                mask &= np.isin(self.codes[col], wanted[wanted >= 0])
+        if name_keyword and "品名" in self.codes:
+            matched = np.flatnonzero(self.options["品名"].str.contains(name_keyword, case=False, regex=False))
+            mask &= np.isin(self.codes["品名"], matched)
+        return np.flatnonzero(mask)
+
+    def column_positions(self, month_from: str = None, month_to: str = None) -> list[int]:
+        """品名等标识列 + 月份范围内的列，保持原列顺序"""
+        selected = [
+            pos for month, positions in self.month_positions.items()
+            if (month_from is None or month >= month_from) and (month_to is None or month <= month_to)
+            for pos in positions
+        ]
+        return sorted(self.id_positions + selected)
+
+    def page(self, rows: np.ndarray, columns: list[int], page: int, page_size: int) -> pd.DataFrame:
+        """取第 page 页（从 1 开始）；只物化这一页"""
+        start = (page - 1) * page_size
+        return self.df.iloc[rows[start:start + page_size], columns]
+
+
+@st.fragment
+def show_plan_viewer(index: PlanIndex, key: str = "plan_viewer"):
+    """筛选、翻页只重跑本片段，且只把当前页发送到浏览器"""
+    filter_cols = st.columns(len(VIEWER_FILTER_COLUMNS))
+    selections = {}
+    name_keyword = ""
+    for container, col in zip(filter_cols, VIEWER_FILTER_COLUMNS):
+        if col not in index.options:
+            continue
+        if col == "品名":
+            # 品名数量大，用关键字匹配代替下拉列表
+            name_keyword = container.text_input("品名包含", key=f"{key}_name").strip()
+        else:
+            selections[col] = container.multiselect(col, index.options[col].tolist(), key=f"{key}_{col}")
+
+    month_from = month_to = None
+    if len(index.months) > 1:
+        month_from, month_to = st.select_slider(
+            "月份范围", options=index.months, value=(index.months[0], index.months[-1]), key=f"{key}_months"
+        )
+
+    rows = index.rows(selections, name_keyword)
+    columns = index.column_positions(month_from, month_to)
+
+    size_col, page_col, info_col = st.columns([1, 1, 2])
+    page_size = size_col.selectbox("每页行数", VIEWER_PAGE_SIZES, index=1, key=f"{key}_page_size")
+    n_pages = max(1, -(-len(rows) // page_size))
+    # 筛选后页数变少时，把页码收回到范围内（需在创建控件之前设置）
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    page = page_col.number_input("页码", min_value=1, max_value=n_pages, step=1, key=f"{key}_page")
+    info_col.caption(f"共 {len(rows)} 行 / {index.df.shape[0]} 行，{len(columns)} 列，第 {page}/{n_pages} 页")
+
+    st.dataframe(index.page(rows, columns, page, page_size), use_container_width=True, hide_index=True)
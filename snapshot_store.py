@@ -0,0 +1,95 @@
+"""
+预测快照库：按生成月份（文件名中的 8 位日期）分区，
+以列式文件持久化每份已解析、未替换品名的原始预测，供后续只上传新文件时合并历史；
+读取后按当时的新旧料号重新替换品名，因此映射的修改或删除对历史预测同样生效。
+
+目录结构：
+    {root}/gen=yyyymm/{文件名去扩展名}.parquet
+"""
+import os
+import re
+
+import pandas as pd
+
+from parse_cache import write_frame, read_frame, _FORMATS
+
+SNAPSHOT_STORE_DIR = os.environ.get(
+    "FORECAST_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshots")
+)
+
+
+def _stem(file_name: str) -> str:
+    """快照的键：文件名去目录、去扩展名（与快照文件名一致）"""
+    return os.path.splitext(os.path.basename(file_name))[0]
+
+
+class ForecastSnapshotStore:
+    def __init__(self, root: str = SNAPSHOT_STORE_DIR):
+        self.root = root
+
+    def _base_path(self, file_name: str) -> str:
+        from pivot_processor import extract_file_date
+
+        partition = f"gen={extract_file_date(file_name)[:6]}"
+        return os.path.join(self.root, partition, _stem(file_name))
+
+    def save(self, file_name: str, df: pd.DataFrame) -> str:
+        """保存一份原始预测（未替换品名）；同名文件覆盖旧快照"""
+        base_path = self._base_path(file_name)
+        os.makedirs(os.path.dirname(base_path), exist_ok=True)
+        df = df.copy()
+        df.attrs = {"file_name": file_name}
+        return write_frame(df, base_path)
+
+    def list_snapshots(self) -> list[tuple[str, str]]:
+        """返回 [(分区, 文件基路径)]，按生成月份、文件名排序"""
+        if not os.path.isdir(self.root):
+            return []
+        snapshots = []
+        for partition in sorted(os.listdir(self.root)):
+            if not re.fullmatch(r"gen=\d{6}", partition):
+                continue
+            part_dir = os.path.join(self.root, partition)
+            stems = sorted({name[:-len(ext)] for name in os.listdir(part_dir) for ext in _FORMATS if name.endswith(ext)})
+            snapshots.extend((partition, os.path.join(part_dir, stem)) for stem in stems)
+        return snapshots
+
+    def signature(self, exclude=()) -> tuple:
+        """
+        快照库当前内容的指纹（路径 + 修改时间 + 大小），不读取文件；
+        exclude 中的文件名跳过，因此本次上传后写入的快照不改变指纹。
+        """
+        exclude_stems = {_stem(name) for name in exclude}
+        entries = []
+        for partition, base_path in self.list_snapshots():
+            if os.path.basename(base_path) in exclude_stems:
+                continue
+            for ext in _FORMATS:
+                if os.path.exists(base_path + ext):
+                    stat = os.stat(base_path + ext)
+                    entries.append((partition, os.path.basename(base_path) + ext, stat.st_mtime_ns, stat.st_size))
+        return tuple(entries)
+
+    def load(self, exclude=()) -> dict[str, pd.DataFrame]:
+        """
+        读取所有快照，返回 dict[原文件名 -> DataFrame]（按生成月份排序）。
+        exclude 中的文件名跳过（通常是本次新上传、将覆盖快照的文件），与 signature 一样按去扩展名的文件名匹配。
+        """
+        exclude_stems = {_stem(name) for name in exclude}
+        result = {}
+        for _, base_path in self.list_snapshots():
+            if os.path.basename(base_path) in exclude_stems:
+                continue
+            df, _ = read_frame(base_path)
+            if df is None:
+                continue
+            result[df.attrs.get("file_name") or os.path.basename(base_path) + ".xlsx"] = df
+        return result
+
+    def remove(self, file_name: str):
+        """删除某个文件的快照"""
+        base_path = self._base_path(file_name)
+        for ext in _FORMATS:
+            if os.path.exists(base_path + ext):
+                os.remove(base_path + ext)
@@ -17,5 +17,7 @@ def get_uploaded_files():
     st.subheader("🔁 上传新旧料号")
     mapping_file = st.file_uploader("上传新旧料号", type="xlsx", key="mapping")
 
+    use_snapshots = st.checkbox("📚 合并历史预测快照（只需上传新的预测文件）", value=False, key="use_snapshots")
+
     start = st.button("🚀 生成主计划")
-    return forecast_files, order_file, sales_file, mapping_file, start
+    return forecast_files, order_file, sales_file, mapping_file, use_snapshots, start